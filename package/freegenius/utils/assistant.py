@@ -1,12 +1,12 @@
 from freegenius import config, showErrors, getDayOfWeek, getFilenamesWithoutExtension, getStringWidth, stopSpinning, spinning_animation, getLocalStorage, getWebText, getWeather, getCliOutput
 from freegenius import print1, print2, print3, isCommandInstalled, setChatGPTAPIkey, count_tokens_from_functions, setToolDependence, tokenLimits, toggleinputaudio, toggleoutputaudio
-from freegenius import installPipPackage, getDownloadedOllamaModels, getDownloadedGgufModels, extractPythonCode, is_valid_url, getCurrentDateTime, openURL, isExistingPath, is_CJK, exportOllamaModels, runFreeGeniusCommand
+from freegenius import installPipPackage, getDownloadedOllamaModels, getDownloadedGgufModels, extractPythonCode, is_valid_url, getCurrentDateTime, openURL, isExistingPath, is_CJK, exportOllamaModels, runFreeGeniusCommand, clearEmbeddingCache, preloadZeroShotClassifier, preloadDeviceInfo, showBackendClients
+from freegenius import LazyImport, hf_hub_download
 from freegenius.utils.call_llm import CallLLM
 from freegenius.utils.tool_plugins import ToolStore
-import openai, threading, os, traceback, re, subprocess, json, pydoc, shutil, datetime, pprint, sys, copy
-from huggingface_hub import hf_hub_download
+from freegenius.utils.startup_profiler import profileStartupPhase, finishStartupProfile
+import threading, os, traceback, re, subprocess, json, pydoc, shutil, datetime, pprint, sys, copy, contextlib
 from pathlib import Path
-from freegenius.utils.download import Downloader
 from freegenius.utils.ollama_models import ollama_models
 #from pygments.lexers.python import PythonLexer
 #from pygments.lexers.shell import BashLexer
@@ -17,6 +17,7 @@ from prompt_toolkit.history import FileHistory
 from prompt_toolkit.completion import WordCompleter, FuzzyCompleter
 from prompt_toolkit.shortcuts import clear, set_title
 from prompt_toolkit.application import run_in_terminal
+from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit import print_formatted_text, HTML
 from freegenius.utils.terminal_mode_dialogs import TerminalModeDialogs
 from freegenius.utils.prompts import Prompts
@@ -31,32 +32,43 @@ from freegenius.utils.ttsLanguages import TtsLanguages
 from freegenius.utils.streaming_word_wrapper import StreamingWordWrapper
 from freegenius.utils.text_utils import TextUtil
 from freegenius.utils.sttLanguages import googleSpeeckToTextLanguages, whisperSpeeckToTextLanguages
-from freegenius.groqchat import GroqChatbot
-from freegenius.chatgpt import ChatGPT
-from freegenius.llamacpp import LlamacppChat
-from freegenius.llamacppserver import LlamacppServerChat
-from freegenius.ollamachat import OllamaChat
+
+# backends and chatbots are imported on first use, so that startup does not pay for backends that are not selected
+CallLlamaCpp = LazyImport("freegenius.utils.call_llamacpp", "CallLlamaCpp")
+CallOllama = LazyImport("freegenius.utils.call_ollama", "CallOllama")
+Downloader = LazyImport("freegenius.utils.download", "Downloader")
+openai = LazyImport("openai")
+ElevenLabs = LazyImport("elevenlabs.client", "ElevenLabs")
+GroqChatbot = LazyImport("freegenius.groqchat", "GroqChatbot")
+ChatGPT = LazyImport("freegenius.chatgpt", "ChatGPT")
+LlamacppChat = LazyImport("freegenius.llamacpp", "LlamacppChat")
+LlamacppServerChat = LazyImport("freegenius.llamacppserver", "LlamacppServerChat")
+OllamaChat = LazyImport("freegenius.ollamachat", "OllamaChat")
 if not config.isTermux:
-    from freegenius.autobuilder import AutoGenBuilder
-    from freegenius.geminipro import GeminiPro
-    from freegenius.palm2 import Palm2
-    from freegenius.codey import Codey
-from elevenlabs.client import ElevenLabs
+    AutoGenBuilder = LazyImport("freegenius.autobuilder", "AutoGenBuilder")
+    GeminiPro = LazyImport("freegenius.geminipro", "GeminiPro")
+    Palm2 = LazyImport("freegenius.palm2", "Palm2")
+    Codey = LazyImport("freegenius.codey", "Codey")
 
 
 class FreeGenius:
 
     def __init__(self):
         #config.letMeDoItAI = self
-        self.prompts = Prompts()
-        self.dialogs = TerminalModeDialogs(self)
-        self.setup()
-        Plugins.runPlugins()
+        with profileStartupPhase("Prompts"):
+            self.prompts = Prompts()
+            self.dialogs = TerminalModeDialogs(self)
+        with profileStartupPhase("FreeGenius.setup"):
+            self.setup()
+        with profileStartupPhase("Plugins.runPlugins"):
+            Plugins.runPlugins()
+        finishStartupProfile()
 
     def setup(self):
         config.currentMessages = []
         # set up tool store client
-        ToolStore.setupToolStoreClient()
+        with profileStartupPhase("ToolStore.setupToolStoreClient"):
+            ToolStore.setupToolStoreClient()
 
         self.models = list(tokenLimits.keys())
         config.divider = self.divider = "--------------------"
@@ -115,17 +127,29 @@ class FreeGenius:
         if not config.elevenlabsApi:
             self.changeElevenlabsApi()
 
+        # load intent screening classifier in the background
+        if config.intent_screening and config.intent_screening_mode == "classifier" and config.zero_shot_classification_preload:
+            preloadZeroShotClassifier()
+
+        # look up device location in the background, before it is needed in system message
+        preloadDeviceInfo()
+
         # initial completion check at startup
         if config.initialCompletionCheck:
             if config.llmInterface == "llamacppserver":
                 runFreeGeniusCommand("customtoolserver")
                 if config.useAdditionalChatModel:
                     runFreeGeniusCommand("customchatserver")
+            elif config.background_warm_up and config.llmInterface in ("llamacpp", "ollama"):
+                # load models in background; requests wait until they are ready
+                CallLLM.startWarmUp()
             else:
-                CallLLM.checkCompletion()
+                with profileStartupPhase("CallLLM.checkCompletion"):
+                    CallLLM.checkCompletion()
 
         chat_history = os.path.join(config.localStorage, "history", "chats")
-        self.terminal_chat_session = PromptSession(history=FileHistory(chat_history))
+        with profileStartupPhase("PromptSession"):
+            self.terminal_chat_session = PromptSession(history=FileHistory(chat_history))
 
         self.actions = {
             ".new": (f"start a new chat {str(config.hotkey_new)}", None),
@@ -136,6 +160,8 @@ class FreeGenius:
             ".model": ("change large language model", self.setLlmModel),
             #".chatmodel": ("change chat-only model", self.setChatbot),
             ".embedding": ("change embedding model", self.setEmbeddingModel),
+            ".unloadvision": ("unload llama.cpp vision model", lambda: CallLlamaCpp.unloadVisionModel()),
+            ".pin": ("pin or unpin an ollama model in memory", self.pinOllamaModel),
             ".apikeys": ("change API keys", self.changeAPIkeys),
             #".changeapikey": ("change OpenAI API key", self.changeChatGPTAPIkey),
             #".openweathermapapi": ("change OpenWeatherMap API key", self.changeOpenweathermapApi),
@@ -181,6 +207,7 @@ class FreeGenius:
             ".install": ("install python package", self.installPythonPackage),
             ".system": (f"open system command prompt {str(config.hotkey_launch_system_prompt)}", lambda: SystemCommandPrompt().run(allowPathChanges=True)),
             ".content": ("display current directory content", self.getPath.displayDirectoryContent),
+            ".clients": ("display backend clients and their connection reuses", showBackendClients),
             ".keys": (f"display key bindings {str(config.hotkey_display_key_combo)}", config.showKeyBindings),
             ".help": ("open LetMeDoIt wiki", lambda: openURL('https://github.com/eliranwong/letmedoit/wiki')),
             ".donate": ("donate and support LetMeDoIt AI", lambda: openURL('https://www.paypal.com/paypalme/letmedoitai')),
@@ -534,27 +561,7 @@ class FreeGenius:
 
     # update system message
     def updateSystemMessage(self, messages):
-        for index, message in enumerate(messages):
-            try:
-                if message.get("role", "") == "system":
-                    # update system mess
-                    dayOfWeek = getDayOfWeek()
-                    message["content"] = re.sub(
-                        """^Current directory: .*?\nCurrent time: .*?\nCurrent day of the week: .*?$""",
-                        f"""Current directory: {os.getcwd()}\nCurrent time: {str(datetime.datetime.now())}\nCurrent day of the week: {dayOfWeek}""",
-                        message["content"],
-                        flags=re.M,
-                    )
-                    messages[index] = message
-                    # in a long conversation, ChatGPT often forgets its system message
-                    # move forward if conversation have started, to enhance system message
-                    if config.conversationStarted and not index == len(messages) - 1:
-                        item = messages.pop(index)
-                        messages.append(item)
-                    break
-            except:
-                pass
-        return messages
+        return CallLLM.updateSystemMessage(messages)
 
     def getCurrentContext(self):
         if not config.predefinedContext in config.predefinedContexts:
@@ -858,10 +865,10 @@ class FreeGenius:
     # change configs
     def editConfigs(self):
         # file paths
-        configFile = os.path.join(config.freeGeniusAIFolder, "config.py")
-        backupFile = os.path.join(config.localStorage, "config_backup.py")
+        configFile = os.path.join(config.freeGeniusAIFolder, "config.json")
+        backupFile = os.path.join(config.localStorage, "config_backup.json")
         # backup configs
-        config.saveConfig()
+        config.flushConfig()
         shutil.copy(configFile, backupFile)
         # open current configs with built-in text editor
         customTextEditor = config.customTextEditor if config.customTextEditor else f"{sys.executable} {os.path.join(config.freeGeniusAIFolder, 'eTextEdit.py')}"
@@ -882,6 +889,24 @@ class FreeGenius:
             except:
                 print2("Failed to restore backup!")
 
+    def pinOllamaModel(self):
+        CallLLM.waitForWarmUp(retry=False)
+        options = list(dict.fromkeys([config.ollamaMainModel, config.ollamaChatModel, config.ollamaVisionModel] + config.ollamaPinnedModels))
+        descriptions = [f"{i} [{'pinned' if i in config.ollamaPinnedModels else 'not pinned'}]" for i in options]
+        question = "Select a model to pin or unpin:"
+        print1(question)
+        model = self.dialogs.getValidOptions(
+            options=options,
+            descriptions=descriptions,
+            title="Pin Ollama Model",
+            text=question,
+        )
+        if model:
+            try:
+                CallOllama.togglePinModel(model)
+            except:
+                print2(f"Failed to load '{model}'! Is ollama running?")
+
     def installPythonPackage(self):
         print1("Enter a python package name:")
         package = self.prompts.simplePrompt(style=self.prompts.promptStyle2)
@@ -1003,11 +1028,29 @@ class FreeGenius:
             if intent_screening:
                 if intent_screening == "yes":
                     config.intent_screening = True
+                    askIntentScreeningMode()
                     return True
                 else:
                     config.intent_screening = False
             return False
 
+        def askIntentScreeningMode():
+            options = ("classifier", "embedding")
+            descriptions = (f"zero-shot classification with '{config.zero_shot_classification_model}'", f"faster similarity search with '{config.embeddingModel}'")
+            question = "Select a screening method:"
+            print1(question)
+            intent_screening_mode = self.dialogs.getValidOptions(
+                options=options,
+                descriptions=descriptions,
+                title="Intent Screening Mode",
+                default=config.intent_screening_mode,
+                text=question,
+            )
+            if intent_screening_mode:
+                config.intent_screening_mode = intent_screening_mode
+
+        # models are changed below; let warm-up finish loading the current ones first
+        CallLLM.waitForWarmUp(retry=False)
         currentLlmInterface = config.llmInterface
         self.selectLlmPlatform()
 
@@ -1321,6 +1364,10 @@ class FreeGenius:
                     print3(f"Embedding model: {oldEmbeddingModel}")
         if not oldEmbeddingModel == config.embeddingModel:
             config.saveConfig()
+            # cached embedding functions and collections are bound to the old model
+            clearEmbeddingCache()
+            ToolStore.setupToolStoreClient()
+            Plugins.runPlugins()
 
     def setAutoGenBuilderConfig(self):
         if not config.isTermux:
@@ -1903,7 +1950,7 @@ class FreeGenius:
     def startChats(self):
         tokenValidator = TokenValidator()
         def getDynamicToolBar():
-            return config.dynamicToolBarText
+            return f"{config.dynamicToolBarText}{CallLLM.getWarmUpStatus()}"
         def startChat():
             clear()
             print1(self.divider)
@@ -1947,7 +1994,10 @@ class FreeGenius:
             config.defaultEntry = ""
 
             # user input
-            userInput = self.prompts.simplePrompt(promptSession=self.terminal_chat_session, completer=completer_developer if config.developer else completer, default=defaultEntry, accept_default=accept_default, validator=tokenValidator, bottom_toolbar=getDynamicToolBar)
+            # refresh toolbar and keep background output above the prompt while models are loading
+            warmingUp = CallLLM.isWarmingUp()
+            with patch_stdout() if warmingUp else contextlib.nullcontext():
+                userInput = self.prompts.simplePrompt(promptSession=self.terminal_chat_session, completer=completer_developer if config.developer else completer, default=defaultEntry, accept_default=accept_default, validator=tokenValidator, bottom_toolbar=getDynamicToolBar, refresh_interval=0.5 if warmingUp else 0)
             
             # update system message when user enter a new input
             config.currentMessages = self.updateSystemMessage(config.currentMessages)
@@ -2177,11 +2227,16 @@ My writing:
                     storagedirectory, config.currentMessages = startChat()
 
     def launchChatbot(self, chatbot, fineTunedUserInput):
+        # chatbots use loaded models directly
+        CallLLM.waitForWarmUp()
         if not chatbot:
             chatbot = config.llmInterface
         if config.isTermux:
             #chatbot = "chatgpt"
             ...
+        if chatbot == "llamacpp" and not config.useAdditionalChatModel and getattr(config, "llamacppMainModel", None) is not None:
+            # the chatbot uses the main model directly, without CallLlamaCpp.createChatCompletion, where its context window is fitted
+            CallLlamaCpp.fitContextWindow(config.currentMessages + [{"role": "user", "content": fineTunedUserInput}], config.llamacppMainModel_max_tokens)
         chatbots = {
             "llamacpp": lambda: LlamacppChat(model=None if config.useAdditionalChatModel else config.llamacppMainModel).run(fineTunedUserInput),
             "llamacppserver": lambda: LlamacppServerChat().run(fineTunedUserInput),
@@ -2,6 +2,7 @@ from freegenius import showErrors, get_or_create_collection, query_vectors, show
 from freegenius import config
 from freegenius import print1, print2, print3, getDynamicTokens, selectTool, selectEnabledTool
 import re, traceback, openai, pprint, copy, textwrap, json, pygments
+from concurrent.futures import ThreadPoolExecutor
 from pygments.lexers.python import PythonLexer
 from prompt_toolkit import print_formatted_text, HTML
 from prompt_toolkit.formatted_text import PygmentsTokens
@@ -295,6 +296,49 @@ def finetuneSingleFunctionCallResponse(func_arguments, function_name):
         function_response = fuction_to_call(function_args)
     return function_response
 
+def runToolCalls(tool_calls: list) -> list:
+    """
+    run tool calls, given as (function_name, func_arguments), of a single response, in the order of tool calls
+    return a list of (function_response, tempContent) in the same order
+    consecutive calls of tools declared concurrent run in a thread pool; calls of other tools, which may ask for confirmation or pass content via config.tempContent, run one by one after calls before them
+    """
+    results = []
+
+    def runSerially(function_name, func_arguments):
+        response = finetuneSingleFunctionCallResponse(func_arguments, function_name)
+        if config.tempContent and function_name in config.concurrentTools:
+            # wrongly declared concurrent, as config.tempContent is shared by all threads
+            config.concurrentTools.remove(function_name)
+        results.append([response, config.tempContent])
+        config.tempContent = ""
+
+    def runBatch(batch):
+        if config.max_parallel_tool_calls > 1 and len(batch) > 1:
+            with ThreadPoolExecutor(max_workers=min(config.max_parallel_tool_calls, len(batch))) as executor:
+                futures = [executor.submit(finetuneSingleFunctionCallResponse, func_arguments, function_name) for function_name, func_arguments in batch]
+                results.extend([future.result(), ""] for future in futures)
+            if config.tempContent:
+                # a tool declared concurrent set config.tempContent; the content cannot be traced to a call, so run these tools serially from now on
+                for function_name, _ in batch:
+                    if function_name in config.concurrentTools:
+                        config.concurrentTools.remove(function_name)
+                if config.developer:
+                    print2(f"Content passed by one of {', '.join(function_name for function_name, _ in batch)} is dropped; these tools will run serially.")
+                config.tempContent = ""
+        else:
+            for function_name, func_arguments in batch:
+                runSerially(function_name, func_arguments)
+        batch.clear()
+
+    batch = []
+    for function_name, func_arguments in tool_calls:
+        if function_name in config.concurrentTools and not function_name == "python":
+            batch.append((function_name, func_arguments))
+        else:
+            runBatch(batch)
+            runSerially(function_name, func_arguments)
+    runBatch(batch)
+    return results
 
 class CallChatGPT:
 
@@ -588,28 +632,28 @@ class CallLetMeDoIt:
 
                 func_responses = ""
                 bypassFunctionCall = False
-                # handle function calls
-                for func in function_calls:
-                    func_index = func.index
-                    func_id = func.id
-                    func_name = func.function.name
-                    func_arguments = toolArguments[func_index]
-
-                    if config.developer:
-                        print2(f"```{func_name}")
+                if config.developer:
+                    for func in function_calls:
+                        print2(f"```{func.function.name}")
                         try:
-                            pprint.pprint(json.loads(func_arguments))
+                            pprint.pprint(json.loads(toolArguments[func.index]))
                         except:
-                            pprint.pprint(func_arguments)
+                            pprint.pprint(toolArguments[func.index])
                         print2("```")
 
-                    # get function response
-                    func_response = CallLetMeDoIt.finetuneSingleFunctionCallResponse(func_arguments, func_name)
+                # get function responses; independent calls run concurrently
+                func_results = runToolCalls([(func.function.name, toolArguments[func.index]) for func in function_calls])
+
+                # handle function calls, in the order they are called
+                for func, (func_response, tempContent) in zip(function_calls, func_results):
+                    func_id = func.id
+                    func_name = func.function.name
+                    func_arguments = toolArguments[func.index]
 
                     # "[INVALID]" practically mean that it ignores previously called function and continues chat without function calling
                     if func_response == "[INVALID]":
                         bypassFunctionCall = True
-                    elif func_response or config.tempContent:
+                    elif func_response or tempContent:
                         # send the function call info and response to GPT
                         function_call_message = {
                             "role": "assistant",
@@ -628,10 +672,9 @@ class CallLetMeDoIt:
                                 "tool_call_id": func_id,
                                 "role": "function",
                                 "name": func_name,
-                                "content": func_response if func_response else config.tempContent,
+                                "content": func_response if func_response else tempContent,
                             }
                         )  # extend conversation with function response
-                        config.tempContent = ""
                         if func_response:
                             func_responses += f"\n{func_response}\n{config.divider}"
 
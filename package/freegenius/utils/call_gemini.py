@@ -5,13 +5,16 @@ from prompt_toolkit import prompt
 import traceback, os, json, pprint, copy, datetime, codecs
 from typing import Optional, List, Dict, Union
 import vertexai
-from vertexai.generative_models import GenerativeModel, FunctionDeclaration, Tool
+from vertexai.generative_models import GenerativeModel, FunctionDeclaration, Tool, Content, Part
 from vertexai.generative_models._generative_models import (
     GenerationConfig,
     HarmCategory,
     HarmBlockThreshold,
 )
 
+# conversation kept in a Vertex AI chat session across turns; see CallGemini.getChatSession
+chatSession = {"chat": None, "turns": [], "pending": None}
+
 class CallGemini:
 
     @staticmethod
@@ -29,6 +32,7 @@ class CallGemini:
             print("LLM interface changed back to 'llamacpp'")
         # initiation
         vertexai.init()
+        chatSession["chat"] = None
         
         config.geminipro_generation_config=GenerationConfig(
             temperature=config.llmTemperature, # 0.0-1.0; default 0.9
@@ -108,23 +112,87 @@ Remember, give me the python code ONLY, without additional notes or explanation.
         else:
             return "[INVALID]"
 
+    @staticmethod
+    def splitMessages(messages: list) -> tuple:
+        """
+        split messages into chat turns, system message and the last user message, as toGeminiMessages does, without building Content objects
+        """
+        turns, systemMessage = [], ""
+        for i in messages:
+            role, content = i.get("role", ""), i.get("content", "")
+            if role in ("user", "assistant"):
+                turns.append((role, content))
+            elif role == "system":
+                systemMessage = f"{systemMessage}\n\n{content}" if systemMessage else content
+        # the last user message is sent with a call, rather than in history
+        if turns and turns[-1][0] == "user":
+            return turns[:-1], systemMessage, turns[-1][1]
+        return turns, systemMessage, ""
+
+    @staticmethod
+    def isChatSessionCurrent(turns: list) -> bool:
+        """
+        check if the chat session holds the conversation before the last user message
+        """
+        chat, pending = chatSession["chat"], chatSession["pending"]
+        if chat is None:
+            return False
+        if pending is not None:
+            expected = chatSession["turns"] + [("user", pending)]
+            # vertex ai adds a streamed reply to chat history only when streaming is completed
+            if len(chat.history) == len(expected) + 1 and len(turns) == len(expected) + 1 and turns[:-1] == expected and turns[-1][0] == "assistant":
+                # keep session history the same as rebuilt history, i.e. the request without system message and the reply as recorded in messages
+                chat.history[-2:] = [Content(role="user", parts=[Part.from_text(pending)]), Content(role="model", parts=[Part.from_text(turns[-1][1])])]
+                chatSession["turns"] = turns
+                chatSession["pending"] = None
+        return chatSession["turns"] == turns
+
+    @staticmethod
+    def getChatSession(messages: list, turns: Optional[list]=None):
+        """
+        Vertex AI chat session of the conversation, to which only new messages are added on each turn
+        a session is rebuilt from full history only when the conversation is edited, e.g. a new chat, a context change or compaction
+        """
+        if turns is None:
+            turns, *_ = CallGemini.splitMessages(messages)
+        if not CallGemini.isChatSessionCurrent(turns):
+            history, *_ = toGeminiMessages(messages=messages)
+            chatSession["chat"] = config.geminipro_model.start_chat(history=history)
+            chatSession["turns"] = turns
+            chatSession["pending"] = None
+        return chatSession["chat"]
+
+    @staticmethod
+    def getHistory(messages: list) -> Optional[list]:
+        """
+        history of messages for a separate call, e.g. tool screening or parameter extraction; taken from the chat session when it is current
+        """
+        turns, *_ = CallGemini.splitMessages(messages)
+        if CallGemini.isChatSessionCurrent(turns):
+            return list(chatSession["chat"].history) or None
+        history, *_ = toGeminiMessages(messages=messages)
+        return history
+
     @staticmethod
     def regularCall(messages: dict, useSystemMessage: bool=True, **kwargs):
-        history, systemMessage, lastUserMessage = toGeminiMessages(messages=messages)
+        turns, systemMessage, lastUserMessage = CallGemini.splitMessages(messages)
         userMessage = f"{systemMessage}\n\nHere is my request:\n{lastUserMessage}" if useSystemMessage and systemMessage else lastUserMessage
-        chat = config.geminipro_model.start_chat(history=history)
-        return chat.send_message(
+        chat = CallGemini.getChatSession(messages, turns)
+        completion = chat.send_message(
             userMessage,
             generation_config=config.geminipro_generation_config,
             safety_settings=config.geminipro_safety_settings,
             stream=True,
             **kwargs,
         )
+        chatSession["pending"] = lastUserMessage
+        return completion
 
     @staticmethod
     def getDictionaryOutput(history: list, schema: dict, userMessage: str, **kwargs) -> dict:
         name, description, parameters = schema["name"], schema["description"], schema["parameters"]
-        chat = config.geminipro_model.start_chat(history=history)
+        # a copy, as a chat session adds messages to its history
+        chat = config.geminipro_model.start_chat(history=list(history) if history else None)
         # declare a function
         function_declaration = FunctionDeclaration(
             name=name,
@@ -156,7 +224,7 @@ Remember, give me the python code ONLY, without additional notes or explanation.
     def getSingleChatResponse(userInput: str, history: Optional[list]=None, **kwargs) -> str:
         # non-streaming single call
         try:
-            chat = config.geminipro_model.start_chat(history=history)
+            chat = config.geminipro_model.start_chat(history=list(history) if history else None)
             completion = chat.send_message(
                 userInput,
                 generation_config=config.geminipro_generation_config,
@@ -327,7 +395,7 @@ Your response:
 {user_request}{deviceInfo}
 </request>"""
 
-        history, *_ = toGeminiMessages(messages=messages)
+        history = CallGemini.getHistory(messages)
 
         output = CallGemini.getDictionaryOutput(history, schema=schema, userMessage=userMessage)
         chatOnly = True if "yes" in str(output).lower() else False
@@ -341,7 +409,8 @@ Your response:
         Extract action parameters
         """
 
-        history, _, lastUserMessage = toGeminiMessages(messages=ongoingMessages)
+        history = CallGemini.getHistory(ongoingMessages)
+        _, _, lastUserMessage = CallGemini.splitMessages(ongoingMessages)
 
         deviceInfo = f"""
 
@@ -1,16 +1,95 @@
-from freegenius import config, showErrors, get_or_create_collection, query_vectors, getDeviceInfo, isValidPythodCode, executeToolFunction, toParameterSchema, getCpuThreads
+from freegenius import config, showErrors, get_or_create_collection, query_vectors, getDeviceInfo, isValidPythodCode, executeToolFunction, toParameterSchema, getCpuThreads, getContextWindowSize, getMaxOutputTokens, getParameterExtractionMessages
+from freegenius.utils.call_llm import CallLLM
 from freegenius import print1, print2, print3, selectTool, getPythonFunctionResponse, extractPythonCode, downloadStableDiffusionFiles, isToolRequired, encode_image, selectEnabledTool
 from typing import Optional
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaRAMCache, LlamaDiskCache, LlamaGrammar
 from llama_cpp.llama_chat_format import Llava15ChatHandler
 from prompt_toolkit import prompt
 from pathlib import Path
 from huggingface_hub import hf_hub_download
-import traceback, json, re, os, pprint, copy, datetime
+import traceback, json, re, os, pprint, copy, datetime, threading, time
 
 
+# resident vision model; see CallLlamaCpp.loadVisionModel
+visionModelLock = threading.RLock()
+visionModelState = {"key": None, "timer": None, "chat_handler": None}
+
+# training context sizes, by model path; see CallLlamaCpp.getTrainingContextSize
+trainingContextSizes = {}
+
+# grammars compiled from tool parameter schemas, by tool name; see CallLlamaCpp.getToolGrammar
+toolGrammars = {}
+
+# prompt state cache lookups of the main model; see CallLlamaCpp.createChatCompletion
+promptCacheStats = {"hits": 0, "misses": 0}
+
+class PromptCacheStatsMixin:
+
+    def __getitem__(self, key):
+        try:
+            value = super().__getitem__(key)
+        except KeyError:
+            promptCacheStats["misses"] += 1
+            raise
+        promptCacheStats["hits"] += 1
+        return value
+
+class StatsLlamaRAMCache(PromptCacheStatsMixin, LlamaRAMCache):
+    pass
+
+class StatsLlamaDiskCache(PromptCacheStatsMixin, LlamaDiskCache):
+    pass
+
 class CallLlamaCpp:
 
+    @staticmethod
+    def getTrainingContextSize() -> int:
+        """
+        training context of the main model, read with its vocabulary only, i.e. without loading weights or allocating a context window
+        """
+        if not config.llamacppMainModel_model_path in trainingContextSizes:
+            trainingContextSizes[config.llamacppMainModel_model_path] = Llama(model_path=config.llamacppMainModel_model_path, vocab_only=True, verbose=False).n_ctx_train()
+        return trainingContextSizes[config.llamacppMainModel_model_path]
+
+    @staticmethod
+    def createMainModel(n_ctx: Optional[int]=None):
+        if not config.llamacppMainModel_n_ctx == "auto":
+            n_ctx = config.llamacppMainModel_n_ctx
+        elif n_ctx is None:
+            # size the first context window for a new chat with the default output budget, so that the first request does not reload the model; see CallLlamaCpp.fitContextWindow
+            n_ctx = getContextWindowSize(f"llamacpp:{config.llamacppMainModel_model_path}", CallLLM.resetMessages(), config.llamacppMainModel_max_tokens, maximum=CallLlamaCpp.getTrainingContextSize())
+        config.llamacppMainModel = None
+        cpuThreads = getCpuThreads()
+        config.llamacppMainModel = Llama(
+            model_path=config.llamacppMainModel_model_path,
+            chat_format="chatml",
+            n_ctx=n_ctx,
+            n_batch=config.llamacppMainModel_n_batch,
+            verbose=config.llamacppMainModel_verbose,
+            n_threads=cpuThreads,
+            n_threads_batch=cpuThreads,
+            n_gpu_layers=config.llamacppMainModel_n_gpu_layers,
+            **config.llamacppMainModel_additional_model_options,
+        )
+        # cache prompt states, so that shared system message and history are not evaluated again in multi-step calls
+        if config.llamacppMainModel_cache_type == "ram":
+            config.llamacppMainModel.set_cache(StatsLlamaRAMCache(capacity_bytes=config.llamacppMainModel_cache_capacity))
+        elif config.llamacppMainModel_cache_type == "disk":
+            # states are valid for one model only
+            cache_dir = os.path.join(config.localStorage, "cache", "llamacpp", os.path.basename(config.llamacppMainModel_model_path))
+            config.llamacppMainModel.set_cache(StatsLlamaDiskCache(cache_dir=cache_dir, capacity_bytes=config.llamacppMainModel_cache_capacity))
+
+    @staticmethod
+    def fitContextWindow(messages: list, max_tokens: Optional[int]=None):
+        """
+        in "auto" context mode, reload the main model with a larger context window when the messages and output budget no longer fit
+        """
+        if config.llamacppMainModel_n_ctx == "auto":
+            n_ctx = getContextWindowSize(f"llamacpp:{config.llamacppMainModel_model_path}", messages, max_tokens if max_tokens else -1, maximum=config.llamacppMainModel.n_ctx_train())
+            if n_ctx > config.llamacppMainModel.n_ctx():
+                print2(f"Reloading main model with context window: {n_ctx} ...")
+                CallLlamaCpp.createMainModel(n_ctx)
+
     @staticmethod
     def checkCompletion():
 
@@ -30,19 +109,7 @@ class CallLlamaCpp:
                     local_dir=llm_directory,
                     #local_dir_use_symlinks=False,
                 )
-            config.llamacppMainModel = None
-            cpuThreads = getCpuThreads()
-            config.llamacppMainModel = Llama(
-                model_path=config.llamacppMainModel_model_path,
-                chat_format="chatml",
-                n_ctx=config.llamacppMainModel_n_ctx,
-                n_batch=config.llamacppMainModel_n_batch,
-                verbose=config.llamacppMainModel_verbose,
-                n_threads=cpuThreads,
-                n_threads_batch=cpuThreads,
-                n_gpu_layers=config.llamacppMainModel_n_gpu_layers,
-                **config.llamacppMainModel_additional_model_options,
-            )
+            CallLlamaCpp.createMainModel()
 
         def downloadChatModel():
             llamacppChatModel_model_path = os.path.join(llm_directory, config.llamacppChatModel_filename)
@@ -179,32 +246,101 @@ Remember, output the new copy of python code ONLY, without additional notes or e
         else:
             return "[INVALID]"
 
+    @staticmethod
+    def createChatCompletion(**kwargs):
+        """
+        create chat completion with the main model
+        prompt cache lookup and evaluation time are reported in developer mode; time to first token is reported for streaming calls
+        """
+        CallLlamaCpp.fitContextWindow(kwargs.get("messages", []), kwargs.get("max_tokens", None))
+        if not config.developer:
+            return config.llamacppMainModel.create_chat_completion(**kwargs)
+        hits, misses = promptCacheStats["hits"], promptCacheStats["misses"]
+        start = time.perf_counter()
+        def report(label, seconds):
+            lookup = "hit" if promptCacheStats["hits"] > hits else "miss" if promptCacheStats["misses"] > misses else "disabled"
+            print3(f"Prompt cache: {lookup} (hits: {promptCacheStats['hits']}; misses: {promptCacheStats['misses']}); {label}: {seconds:.2f}s")
+        completion = config.llamacppMainModel.create_chat_completion(**kwargs)
+        if kwargs.get("stream", False):
+            def streamCompletion():
+                promptEvalTime = None
+                for chunk in completion:
+                    if promptEvalTime is None:
+                        promptEvalTime = time.perf_counter() - start
+                    yield chunk
+                print("")
+                report("prompt evaluation", promptEvalTime if promptEvalTime is not None else time.perf_counter() - start)
+            return streamCompletion()
+        report("completion", time.perf_counter() - start)
+        return completion
+
     @staticmethod
     def regularCall(messages: dict, temperature: Optional[float]=None, max_tokens: Optional[int]=None):
-        return config.llamacppMainModel.create_chat_completion(
+        max_tokens = getMaxOutputTokens(messages, max_tokens if max_tokens is not None else config.llamacppMainModel_max_tokens, "llamacpp")
+        if max_tokens is None:
+            return iter(())
+        return CallLlamaCpp.createChatCompletion(
             messages=messages,
             temperature=temperature if temperature is not None else config.llmTemperature,
-            max_tokens=max_tokens if max_tokens is not None else config.llamacppMainModel_max_tokens,
+            max_tokens=max_tokens,
             stream=True,
             **config.llamacppMainModel_additional_chat_options,
         )
 
+    @staticmethod
+    def loadVisionModel():
+        """
+        load llava model and its clip projector once; they stay resident until unloaded or idle for config.llamacppVisionModel_idle_timeout seconds
+        """
+        key = (config.llamacppVisionModel_model_path, config.llamacppVisionModel_clip_model_path)
+        if getattr(config, "llamacppVisionModel", None) is None or not visionModelState["key"] == key:
+            CallLlamaCpp.unloadVisionModel(notify=False)
+            chat_handler = Llava15ChatHandler(clip_model_path=config.llamacppVisionModel_clip_model_path)
+            cpuThreads = getCpuThreads()
+            config.llamacppVisionModel = Llama(
+                model_path=config.llamacppVisionModel_model_path,
+                chat_handler=chat_handler,
+                logits_all=True, # needed to make llava work
+                n_ctx=config.llamacppVisionModel_n_ctx, # n_ctx should be increased to accomodate the image embedding
+                n_batch=config.llamacppVisionModel_n_batch,
+                verbose=config.llamacppVisionModel_verbose,
+                n_threads=cpuThreads,
+                n_threads_batch=cpuThreads,
+                n_gpu_layers=config.llamacppVisionModel_n_gpu_layers,
+                **config.llamacppVisionModel_additional_model_options,
+            )
+            visionModelState["key"] = key
+            visionModelState["chat_handler"] = chat_handler
+        return config.llamacppVisionModel
+
+    @staticmethod
+    def scheduleVisionModelUnload():
+        if visionModelState["timer"] is not None:
+            visionModelState["timer"].cancel()
+        if config.llamacppVisionModel_idle_timeout > 0:
+            visionModelState["timer"] = threading.Timer(config.llamacppVisionModel_idle_timeout, CallLlamaCpp.unloadVisionModel, kwargs={"notify": False})
+            visionModelState["timer"].daemon = True
+            visionModelState["timer"].start()
+
+    @staticmethod
+    def unloadVisionModel(notify=True):
+        with visionModelLock:
+            if visionModelState["timer"] is not None:
+                visionModelState["timer"].cancel()
+                visionModelState["timer"] = None
+            visionModelState["chat_handler"] = None
+            if getattr(config, "llamacppVisionModel", None) is not None:
+                if hasattr(config.llamacppVisionModel, "close"):
+                    config.llamacppVisionModel.close()
+                config.llamacppVisionModel = None
+                visionModelState["key"] = None
+                if notify:
+                    print2("Vision model unloaded!")
+            elif notify:
+                print2("Vision model is not loaded!")
+
     @staticmethod
     def img_to_txt(file_path: str, query: str="Describe this image in detail please.", temperature: Optional[float]=None, max_tokens: Optional[int]=None, messages: Optional[list]=None):
-        chat_handler = Llava15ChatHandler(clip_model_path=config.llamacppVisionModel_clip_model_path)
-        cpuThreads = getCpuThreads()
-        llm = Llama(
-            model_path=config.llamacppVisionModel_model_path,
-            chat_handler=chat_handler,
-            logits_all=True, # needed to make llava work
-            n_ctx=config.llamacppVisionModel_n_ctx, # n_ctx should be increased to accomodate the image embedding
-            n_batch=config.llamacppVisionModel_n_batch,
-            verbose=config.llamacppVisionModel_verbose,
-            n_threads=cpuThreads,
-            n_threads_batch=cpuThreads,
-            n_gpu_layers=config.llamacppVisionModel_n_gpu_layers,
-            **config.llamacppVisionModel_additional_model_options,
-        )
         # update messages
         if messages is None:
             messages = [
@@ -222,23 +358,27 @@ Remember, output the new copy of python code ONLY, without additional notes or e
                 ]
             }
         )
-        try:
-            completion = llm.create_chat_completion(
-                messages=messages,
-                temperature=temperature if temperature is not None else config.llmTemperature,
-                max_tokens=max_tokens if max_tokens is not None else config.llamacppVisionModel_max_tokens,
-                stream=False,
-                **config.llamacppVisionModel_additional_chat_options,
-            )
-            return completion["choices"][0]["message"].get("content", "")
-        except:
-            return ""
+        with visionModelLock:
+            llm = CallLlamaCpp.loadVisionModel()
+            try:
+                completion = llm.create_chat_completion(
+                    messages=messages,
+                    temperature=temperature if temperature is not None else config.llmTemperature,
+                    max_tokens=max_tokens if max_tokens is not None else config.llamacppVisionModel_max_tokens,
+                    stream=False,
+                    **config.llamacppVisionModel_additional_chat_options,
+                )
+                return completion["choices"][0]["message"].get("content", "")
+            except:
+                return ""
+            finally:
+                CallLlamaCpp.scheduleVisionModelUnload()
 
     @staticmethod
     def getDictionaryOutput(messages: list, schema: dict={}, temperature: Optional[float]=None, max_tokens: Optional[int]=None) -> dict:
         schema = toParameterSchema(schema)
         try:
-            completion = config.llamacppMainModel.create_chat_completion(
+            completion = CallLlamaCpp.createChatCompletion(
                 messages=messages,
                 response_format={"type": "json_object", "schema": schema} if schema else {"type": "json_object"},
                 temperature=temperature if temperature is not None else config.llmTemperature,
@@ -259,11 +399,14 @@ Remember, output the new copy of python code ONLY, without additional notes or e
         # non-streaming single call
         if userInput:
             messages.append({"role": "user", "content" : userInput})
+        max_tokens = getMaxOutputTokens(messages, max_tokens if max_tokens is not None else config.llamacppMainModel_max_tokens, "llamacpp")
+        if max_tokens is None:
+            return ""
         try:
-            completion = config.llamacppMainModel.create_chat_completion(
+            completion = CallLlamaCpp.createChatCompletion(
                 messages=messages,
                 temperature=temperature if temperature is not None else config.llmTemperature,
-                max_tokens=max_tokens if max_tokens is not None else config.llamacppMainModel_max_tokens,
+                max_tokens=max_tokens,
                 stream=False,
                 **config.llamacppMainModel_additional_chat_options,
             )
@@ -471,7 +614,7 @@ Remember, response in JSON with the filled template ONLY.""",
             config.llamacppMainModel_model_path,
             echo = False,
             chat_format="chatml",
-            n_ctx=config.llamacppMainModel_n_ctx,
+            n_ctx=0 if config.llamacppMainModel_n_ctx == "auto" else config.llamacppMainModel_n_ctx,
             n_batch=config.llamacppMainModel_n_batch,
             verbose=config.llamacppMainModel_verbose,
             n_gpu_layers=config.llamacppMainModel_n_gpu_layers,
@@ -494,11 +637,54 @@ Remember, response in JSON with the filled template ONLY.""",
         del lm
         return response
 
+    @staticmethod
+    def getToolGrammar(name: str, schema: dict) -> LlamaGrammar:
+        """
+        GBNF grammar of a tool parameter schema, compiled once per tool; recompiled only if the schema changes, e.g. on plugin reloads
+        """
+        schemaJson = json.dumps(toParameterSchema(schema), sort_keys=True)
+        if not name in toolGrammars or not toolGrammars[name][0] == schemaJson:
+            toolGrammars[name] = (schemaJson, LlamaGrammar.from_json_schema(schemaJson, verbose=config.llamacppMainModel_verbose))
+        return toolGrammars[name][1]
+
+    @staticmethod
+    def extractToolParametersSinglePass(schema: dict, userInput: str, ongoingMessages: list = [], temperature: Optional[float]=None, max_tokens: Optional[int]=None) -> dict:
+        """
+        Extract all action parameters, including code, in one grammar-constrained call
+        """
+        messages = getParameterExtractionMessages(schema, userInput, ongoingMessages)
+        max_tokens = getMaxOutputTokens(messages, max_tokens if max_tokens is not None else config.llamacppMainModel_max_tokens, "llamacpp")
+        if max_tokens is None:
+            return {}
+        try:
+            completion = CallLlamaCpp.createChatCompletion(
+                messages=messages,
+                grammar=CallLlamaCpp.getToolGrammar(schema.get("name", ""), schema),
+                temperature=temperature if temperature is not None else config.llmTemperature,
+                max_tokens=max_tokens,
+                stream=False,
+                **config.llamacppMainModel_additional_chat_options,
+            )
+            parameters = json.loads(completion["choices"][0]["message"].get("content", "{}"))
+        except:
+            showErrors()
+            return {}
+        if parameters.get("code", ""):
+            parameters["code"] = extractPythonCode(parameters["code"], keepInvalid=True)
+
+        if config.developer:
+            print2("```parameters")
+            pprint.pprint(parameters)
+            print2("```")
+        return parameters
+
     @staticmethod
     def extractToolParameters(schema: dict, userInput: str, ongoingMessages: list = [], temperature: Optional[float]=None, max_tokens: Optional[int]=None) -> dict:
         """
         Extract action parameters
         """
+        if config.single_pass_parameter_extraction:
+            return CallLlamaCpp.extractToolParametersSinglePass(schema, userInput, ongoingMessages, temperature, max_tokens)
         schema = toParameterSchema(schema)
         schemaCopy = copy.deepcopy(schema)
 
@@ -1,6 +1,6 @@
 from freegenius import showErrors, get_or_create_collection, query_vectors, showRisk, executeToolFunction, getPythonFunctionResponse, getPygmentsStyle, fineTunePythonCode, confirmExecution
 from freegenius import config
-from freegenius import print1, print2, print3, selectTool, check_llm_errors, toParameterSchema, extractPythonCode, selectEnabledTool, getLlamacppServerClient
+from freegenius import print1, print2, print3, selectTool, check_llm_errors, toParameterSchema, extractPythonCode, selectEnabledTool, getLlamacppServerClient, getMaxOutputTokens
 import re, traceback, pprint, copy, textwrap, json, pygments
 from pygments.lexers.python import PythonLexer
 from prompt_toolkit import print_formatted_text, HTML
@@ -84,13 +84,16 @@ class CallLlamaCppServer:
         non-streaming single call
         """
         messages.append({"role": "user", "content" : userInput})
+        max_tokens = getMaxOutputTokens(messages, max_tokens if max_tokens is not None else config.llamacppMainModel_max_tokens, "llamacppserver")
+        if max_tokens is None:
+            return ""
         try:
             completion = getLlamacppServerClient().chat.completions.create(
                 model="freegenius",
                 messages=messages,
                 n=1,
                 temperature=temperature if temperature is not None else config.llmTemperature,
-                max_tokens=max_tokens if max_tokens is not None else config.llamacppMainModel_max_tokens,
+                max_tokens=max_tokens,
                 stream=False,
                 #**config.groqApi_main_model_additional_chat_options,
             )
@@ -219,12 +222,15 @@ class CallLlamaCppServer:
     @staticmethod
     @check_llm_errors
     def regularCall(messages: dict, temperature: Optional[float]=None, max_tokens: Optional[int]=None):
+        max_tokens = getMaxOutputTokens(messages, max_tokens if max_tokens is not None else config.llamacppMainModel_max_tokens, "llamacppserver")
+        if max_tokens is None:
+            return iter(())
         return getLlamacppServerClient().chat.completions.create(
             model="freegenius",
             messages=messages,
             n=1,
             temperature=temperature if temperature is not None else config.llmTemperature,
-            max_tokens=max_tokens if max_tokens is not None else config.llamacppMainModel_max_tokens,
+            max_tokens=max_tokens,
             stream=True,
             #**config.groqApi_main_model_additional_chat_options,
         )
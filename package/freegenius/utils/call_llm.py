@@ -1,13 +1,23 @@
-from freegenius import config, getDeviceInfo, toGeminiMessages
-from freegenius.utils.call_gemini import CallGemini
-from freegenius.utils.call_ollama import CallOllama
-from freegenius.utils.call_llamacpp import CallLlamaCpp
-from freegenius.utils.call_llamacppserver import CallLlamaCppServer
-from freegenius.utils.call_chatgpt import CallChatGPT, CallLetMeDoIt
-from freegenius.utils.call_groq import CallGroq
+from freegenius import config, getDeviceInfo, getDayOfWeek, print2, countContextTokens, getContextLimit
+from freegenius import LazyImport
+import re, os, datetime, threading, hashlib, json
+
+# backend modules, and the sdks they import, are loaded on first use; only the selected backend is imported
+CallGemini = LazyImport("freegenius.utils.call_gemini", "CallGemini")
+CallOllama = LazyImport("freegenius.utils.call_ollama", "CallOllama")
+CallLlamaCpp = LazyImport("freegenius.utils.call_llamacpp", "CallLlamaCpp")
+CallLlamaCppServer = LazyImport("freegenius.utils.call_llamacppserver", "CallLlamaCppServer")
+CallChatGPT = LazyImport("freegenius.utils.call_chatgpt", "CallChatGPT")
+CallLetMeDoIt = LazyImport("freegenius.utils.call_chatgpt", "CallLetMeDoIt")
+CallGroq = LazyImport("freegenius.utils.call_groq", "CallGroq")
 
 class CallLLM:
 
+    # first line of the trailing system message that carries volatile context in cache-friendly layout
+    contextHeader = "Current context:"
+    # first line of the system message that replaces older turns of a compacted chat
+    summaryHeader = "Summary of earlier conversation:"
+
     # reset message when a new chart is started or context is changed
     @staticmethod
     def resetMessages(prompt="") -> list[dict]:
@@ -15,12 +25,14 @@ class CallLLM:
         systemMessage1 = config.systemMessage_letmedoit if config.systemMessage_letmedoit else f'''You’re {config.freeGeniusAIName}, an advanced AI assistant, capable of both engaging in conversations and executing codes on my {config.thisPlatform} device. When you need to generate code, please make sure your code work on {config.thisPlatform}{distro}. Your functionality expands as I add more plugins to you.
 Always remember that you are much more than a text-based AI. You possess both vision and speech capabilities and have direct access to my device operating system, enabling you to execute tasks at my command. Please do not state otherwise.'''
 
-        systemMessage2 = config.systemMessage_letmedoit if config.systemMessage_letmedoit else f'''You’re {config.freeGeniusAIName}, an advanced AI assistant, capable of both engaging in conversations and executing codes on my device.
-I am providing the basic information of my device below in case you need it:
+        # in cache-friendly layout, device information is sent with volatile context instead, to keep system message unchanged across turns
+        deviceInfo = "I am providing the basic information of my device in a separate system message before my latest request, in case you need it." if config.cache_friendly_system_message else f"""I am providing the basic information of my device below in case you need it:
 ```
 {getDeviceInfo()}
-```
-Please use the current time and date that I have provided above as a reference point for any relative dates and times mentioned in my prompt.
+```"""
+        systemMessage2 = config.systemMessage_letmedoit if config.systemMessage_letmedoit else f'''You’re {config.freeGeniusAIName}, an advanced AI assistant, capable of both engaging in conversations and executing codes on my device.
+{deviceInfo}
+Please use the current time and date that I have provided as a reference point for any relative dates and times mentioned in my prompt.
 You have all the necessary permissions to execute system commands and Python code on my behalf. Your functionality expands as I add more plugins to you. You respond to my prompts and perform tasks based on your own knowledge, the context I provide, as well as the additional knowledge and capabilities provided by plugins.
 
 When replying to my requests, please follow these steps:
@@ -41,8 +53,170 @@ Always remember that you are much more than a text-based AI. You possess both vi
             messages.append({"role": "user", "content": prompt})
         return messages
 
+    # update system message when user enter a new input
+    @staticmethod
+    def updateSystemMessage(messages: list[dict]) -> list[dict]:
+        if config.cache_friendly_system_message:
+            return CallLLM.updateVolatileContext(messages)
+        for index, message in enumerate(messages):
+            try:
+                if message.get("role", "") == "system" and not message.get("content", "").startswith(CallLLM.summaryHeader):
+                    # update system mess
+                    dayOfWeek = getDayOfWeek()
+                    message["content"] = re.sub(
+                        """^Current directory: .*?\nCurrent time: .*?\nCurrent day of the week: .*?$""",
+                        f"""Current directory: {os.getcwd()}\nCurrent time: {str(datetime.datetime.now())}\nCurrent day of the week: {dayOfWeek}""",
+                        message["content"],
+                        flags=re.M,
+                    )
+                    messages[index] = message
+                    # in a long conversation, ChatGPT often forgets its system message
+                    # move forward if conversation have started, to enhance system message
+                    if config.conversationStarted and not index == len(messages) - 1:
+                        item = messages.pop(index)
+                        messages.append(item)
+                    break
+            except:
+                pass
+        return messages
+
+    @staticmethod
+    def updateVolatileContext(messages: list[dict]) -> list[dict]:
+        """
+        keep the first system message byte-identical and send current directory, time and device information in a trailing system message
+        only the context message of the previous input is dropped, so backends can reuse cached evaluation of the rest of the conversation
+        """
+        messages = [i for i in messages if not (i.get("role", "") == "system" and i.get("content", "").startswith(CallLLM.contextHeader))]
+        if config.llmInterface in ("chatgpt", "letmedoit") or config.includeDeviceInfoInContext:
+            context = getDeviceInfo()
+        else:
+            context = f"""Current directory: {os.getcwd()}\nCurrent time: {str(datetime.datetime.now())}\nCurrent day of the week: {getDayOfWeek()}"""
+        messages.append({"role": "system", "content": f"{CallLLM.contextHeader}\n{context}"})
+        return messages
+
+    # the last compaction, i.e. hash of the turns folded into the summary, and the summary; a summary already extended is not kept
+    lastCompaction = {"key": "", "summary": ""}
+
+    @staticmethod
+    def getCompactionThreshold() -> int:
+        if config.compaction_token_threshold:
+            return config.compaction_token_threshold
+        return int(getContextLimit() * 0.75)
+
+    @staticmethod
+    def compactMessages(messages: list[dict]) -> list[dict]:
+        """
+        replace turns older than the last config.compaction_keep_turns with a rolling summary, once messages reach the compaction threshold
+        messages are changed in place, as backends add tool responses to config.currentMessages
+        """
+        threshold = CallLLM.getCompactionThreshold()
+        if threshold <= 0:
+            return messages
+        tokens = countContextTokens(messages)
+        if tokens < threshold:
+            return messages
+        # a turn starts with a user message
+        turnStarts = [index for index, message in enumerate(messages) if message.get("role", "") == "user"]
+        keepTurns = max(1, config.compaction_keep_turns)
+        if len(turnStarts) <= keepTurns:
+            return messages
+        cut = turnStarts[-keepTurns]
+
+        systemMessages, summary, compacted = [], "", []
+        for message in messages[:cut]:
+            role, content = message.get("role", ""), message.get("content", "") or ""
+            if role == "system" and content.startswith(CallLLM.summaryHeader):
+                summary = content[len(CallLLM.summaryHeader):].strip()
+            elif role == "system":
+                # volatile context of earlier inputs is outdated
+                if not content.startswith(CallLLM.contextHeader):
+                    systemMessages.append(message)
+            elif content:
+                compacted.append({"role": role, "content": content})
+        if not compacted:
+            return messages
+
+        # the earlier summary is not part of the key, as it changes with every compaction
+        key = hashlib.sha256(json.dumps(compacted, ensure_ascii=False).encode("utf-8")).hexdigest()
+        if not key == CallLLM.lastCompaction["key"]:
+            summary = CallLLM.summarizeMessages(compacted, summary)
+            if not summary:
+                return messages
+            CallLLM.lastCompaction = {"key": key, "summary": summary}
+        messages[:] = systemMessages + [{"role": "system", "content": f"{CallLLM.summaryHeader}\n{CallLLM.lastCompaction['summary']}"}] + messages[cut:]
+        if config.developer:
+            print2(f"Chat compacted: {tokens} -> {countContextTokens(messages)} tokens")
+        return messages
+
+    @staticmethod
+    def summarizeMessages(messages: list[dict], summary: str="") -> str:
+        transcript = "\n\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        if summary:
+            transcript = f"[Summary of the conversation before]\n{summary}\n\n{transcript}"
+        prompt = f"""Summarise our conversation below, so that we can continue it without the full transcript.
+Keep facts, decisions, names, file paths, code identifiers, results of completed tasks and anything I asked you to remember.
+Reply with the summary only.
+
+```
+{transcript}
+```"""
+        # use the chat model, if one is set, as summaries do not need tools
+        if config.llmInterface == "ollama":
+            return CallOllama.getSingleChatResponse(prompt, messages=[], temperature=0.0, model=config.ollamaChatModel)
+        return CallLLM.getSingleChatResponse(prompt, messages=[], temperature=0.0)
+
+    # models are loaded and verified in a background thread at startup, so that the prompt is usable meanwhile
+    warmUpState = {"thread": None, "failed": False}
+
+    @staticmethod
+    def startWarmUp():
+        def warmUp():
+            try:
+                CallLLM.runCompletionCheck()
+            except:
+                # the check is run again in foreground on the first request, to show the errors
+                CallLLM.warmUpState["failed"] = True
+        CallLLM.warmUpState["failed"] = False
+        CallLLM.warmUpState["thread"] = threading.Thread(target=warmUp, daemon=True)
+        CallLLM.warmUpState["thread"].start()
+
+    @staticmethod
+    def isWarmingUp() -> bool:
+        thread = CallLLM.warmUpState["thread"]
+        return thread is not None and thread.is_alive()
+
+    @staticmethod
+    def getWarmUpStatus() -> str:
+        if CallLLM.isWarmingUp():
+            return f" loading {config.llmInterface} models ... "
+        elif CallLLM.warmUpState["failed"]:
+            return " model check failed "
+        return ""
+
+    @staticmethod
+    def waitForWarmUp(retry=True):
+        """
+        block a request until models are ready
+        """
+        thread = CallLLM.warmUpState["thread"]
+        if thread is None or thread is threading.current_thread():
+            return None
+        if thread.is_alive():
+            print2("Waiting for models to load ...")
+            thread.join()
+        CallLLM.warmUpState["thread"] = None
+        if CallLLM.warmUpState["failed"]:
+            CallLLM.warmUpState["failed"] = False
+            if retry:
+                CallLLM.runCompletionCheck()
+
     @staticmethod
     def checkCompletion():
+        CallLLM.waitForWarmUp(retry=False)
+        return CallLLM.runCompletionCheck()
+
+    @staticmethod
+    def runCompletionCheck():
         if config.llmInterface == "ollama":
             return CallOllama.checkCompletion()
         elif config.llmInterface == "groq":
@@ -60,6 +234,7 @@ Always remember that you are much more than a text-based AI. You possess both vi
 
     @staticmethod
     def autoCorrectPythonCode(code, trace):
+        CallLLM.waitForWarmUp()
         if config.llmInterface == "ollama":
             return CallOllama.autoCorrectPythonCode(code, trace)
         elif config.llmInterface == "groq":
@@ -77,6 +252,7 @@ Always remember that you are much more than a text-based AI. You possess both vi
 
     @staticmethod
     def runSingleFunctionCall(messages, function_name):
+        CallLLM.waitForWarmUp()
         if config.llmInterface == "ollama":
             return CallOllama.runSingleFunctionCall(messages, function_name)
         elif config.llmInterface == "groq":
@@ -94,6 +270,7 @@ Always remember that you are much more than a text-based AI. You possess both vi
 
     @staticmethod
     def regularCall(messages: dict):
+        CallLLM.waitForWarmUp()
         if config.llmInterface == "ollama":
             return CallOllama.regularCall(messages)
         elif config.llmInterface == "groq":
@@ -111,6 +288,7 @@ Always remember that you are much more than a text-based AI. You possess both vi
         """
         non-streaming single call
         """
+        CallLLM.waitForWarmUp()
         if config.llmInterface == "ollama":
             return CallOllama.getSingleChatResponse(userInput, messages=messages, temperature=temperature)
         elif config.llmInterface == "groq":
@@ -120,8 +298,7 @@ Always remember that you are much more than a text-based AI. You possess both vi
         elif config.llmInterface == "llamacpp":
             return CallLlamaCpp.getSingleChatResponse(userInput, messages=messages, temperature=temperature)
         elif config.llmInterface == "gemini":
-            history, *_ = toGeminiMessages(messages=messages)
-            return CallGemini.getSingleChatResponse(userInput, history=history)
+            return CallGemini.getSingleChatResponse(userInput, history=CallGemini.getHistory(messages))
         elif config.llmInterface == "chatgpt":
             return CallChatGPT.getSingleChatResponse(userInput, messages=messages, temperature=temperature)
         # letmedoit
@@ -129,6 +306,7 @@ Always remember that you are much more than a text-based AI. You possess both vi
 
     @staticmethod
     def getSingleFunctionCallResponse(messages, function_name, temperature=None):
+        CallLLM.waitForWarmUp()
         if isinstance(messages, str):
             messages = [{"role": "user", "content" : messages}]
         if config.llmInterface == "ollama":
@@ -148,6 +326,8 @@ Always remember that you are much more than a text-based AI. You possess both vi
 
     @staticmethod
     def runGeniusCall(messages, noFunctionCall=False):
+        CallLLM.waitForWarmUp()
+        CallLLM.compactMessages(messages)
         if config.llmInterface == "ollama":
             return CallOllama.runGeniusCall(messages, noFunctionCall)
         elif config.llmInterface == "groq":
@@ -1,9 +1,10 @@
 from freegenius import showErrors, get_or_create_collection, query_vectors, getDeviceInfo, isValidPythodCode, executeToolFunction, toParameterSchema, selectEnabledTool
 from freegenius import print1, print2, print3, selectTool, getPythonFunctionResponse, extractPythonCode, isValidPythodCode, downloadStableDiffusionFiles, isToolRequired
-from freegenius import config, getOllamaServerClient
+from freegenius import config, getOllamaServerClient, getContextWindowSize, getMaxOutputTokens, getParameterExtractionMessages
 import shutil, re, traceback, json, ollama, pprint, copy, datetime
 from typing import Optional
 from freegenius.utils.download import Downloader
+from freegenius.utils.call_llm import CallLLM
 from ollama import Options
 from prompt_toolkit import prompt
 
@@ -35,6 +36,8 @@ class CallOllama:
         if shutil.which("ollama"):
             for i in (config.ollamaMainModel, config.ollamaChatModel, config.ollamaVisionModel):
                 Downloader.downloadOllamaModel(i)
+            if config.ollamaPreloadModels:
+                CallOllama.preloadModels()
         else:
             print("Ollama not found! Install it first!")
             print("Check https://ollama.com")
@@ -44,6 +47,88 @@ class CallOllama:
             #print("Restarting 'FreeGenius AI' ...")
             #restartApp()
 
+    @staticmethod
+    def getServer(model: str) -> str:
+        if model == config.ollamaMainModel:
+            return "main"
+        elif model == config.ollamaChatModel:
+            return "chat"
+        elif model == config.ollamaVisionModel:
+            return "vision"
+        return "main"
+
+    @staticmethod
+    def getKeepAlive(model: str):
+        """
+        keep alive time of a model; pinned models are kept loaded indefinitely
+        """
+        if model in config.ollamaPinnedModels:
+            return -1
+        elif model in config.ollamaModels_keep_alive:
+            return config.ollamaModels_keep_alive[model]
+        elif model == config.ollamaMainModel:
+            return config.ollamaMainModel_keep_alive
+        elif model == config.ollamaChatModel:
+            return config.ollamaChatModel_keep_alive
+        elif model == config.ollamaVisionModel:
+            return config.ollamaVisionModel_keep_alive
+        return config.ollamaMainModel_keep_alive
+
+    @staticmethod
+    def getNumCtx(model: str, messages: list, num_predict: Optional[int]=None) -> int:
+        isChatModel = model == config.ollamaChatModel and not model == config.ollamaMainModel
+        num_ctx = config.ollamaChatModel_num_ctx if isChatModel else config.ollamaMainModel_num_ctx
+        if num_ctx == "auto":
+            if num_predict is None:
+                num_predict = config.ollamaChatModel_num_predict if isChatModel else config.ollamaMainModel_num_predict
+            # ollama reloads a model whenever num_ctx changes
+            return getContextWindowSize(f"ollama:{model}", messages, num_predict)
+        return num_ctx
+
+    @staticmethod
+    def loadModel(model: str):
+        # a generate request without prompt loads a model and applies its keep alive time
+        # load with the context window of the next request, i.e. a new chat with the default output budget, as ollama reloads a model whenever num_ctx changes
+        response = getOllamaServerClient(CallOllama.getServer(model)).generate(model=model, keep_alive=CallOllama.getKeepAlive(model), options=Options(num_ctx=CallOllama.getNumCtx(model, CallLLM.resetMessages())))
+        CallOllama.reportDurations(response, model)
+
+    @staticmethod
+    def preloadModels():
+        for model in dict.fromkeys((config.ollamaMainModel, config.ollamaChatModel, config.ollamaVisionModel)):
+            try:
+                CallOllama.loadModel(model)
+            except:
+                print2(f"Failed to preload '{model}'!")
+
+    @staticmethod
+    def togglePinModel(model: str):
+        if model in config.ollamaPinnedModels:
+            config.ollamaPinnedModels.remove(model)
+            message = f"'{model}' unpinned; keep alive: {CallOllama.getKeepAlive(model)}"
+        else:
+            config.ollamaPinnedModels.append(model)
+            message = f"'{model}' pinned"
+        config.saveConfig()
+        CallOllama.loadModel(model)
+        print3(message)
+
+    @staticmethod
+    def reportDurations(response, model: str):
+        """
+        report load and evaluation durations, from ollama response metadata, in developer mode
+        """
+        if config.developer and response.get("done", False):
+            toSeconds = lambda key: response.get(key, 0) / 1e9
+            print3(f"Ollama '{model}': load {toSeconds('load_duration'):.2f}s; prompt evaluation {toSeconds('prompt_eval_duration'):.2f}s ({response.get('prompt_eval_count', 0)} tokens); evaluation {toSeconds('eval_duration'):.2f}s ({response.get('eval_count', 0)} tokens); total {toSeconds('total_duration'):.2f}s")
+
+    @staticmethod
+    def streamWithDurations(completion, model: str):
+        for chunk in completion:
+            yield chunk
+            if config.developer and chunk.get("done", False):
+                print("")
+                CallOllama.reportDurations(chunk, model)
+
     @staticmethod
     def autoCorrectPythonCode(code, trace):
         for i in range(config.max_consecutive_auto_correction):
@@ -113,19 +198,23 @@ Remember, give me the python code ONLY, without additional notes or explanation.
     @staticmethod
     @check_ollama_errors
     def regularCall(messages: dict, temperature: Optional[float]=None, num_ctx: Optional[int]=None, num_batch: Optional[int]=None, num_predict: Optional[int]=None):
-        return getOllamaServerClient().chat(
-            keep_alive=config.ollamaMainModel_keep_alive,
+        num_predict = getMaxOutputTokens(messages, num_predict if num_predict is not None else config.ollamaMainModel_num_predict, "ollama", config.ollamaMainModel)
+        if num_predict is None:
+            return iter(())
+        completion = getOllamaServerClient().chat(
+            keep_alive=CallOllama.getKeepAlive(config.ollamaMainModel),
             model=config.ollamaMainModel,
             messages=messages,
             stream=True,
             options=Options(
                 temperature=temperature if temperature is not None else config.llmTemperature,
-                num_ctx=num_ctx if num_ctx is not None else config.ollamaMainModel_num_ctx,
+                num_ctx=num_ctx if num_ctx is not None else CallOllama.getNumCtx(config.ollamaMainModel, messages, num_predict),
                 num_batch=num_batch if num_batch is not None else config.ollamaMainModel_num_batch,
-                num_predict=num_predict if num_predict is not None else config.ollamaMainModel_num_predict,
+                num_predict=num_predict,
                 **config.ollamaMainModel_additional_options,
             ),
         )
+        return CallOllama.streamWithDurations(completion, config.ollamaMainModel)
 
     @staticmethod
     @check_ollama_errors
@@ -133,19 +222,20 @@ Remember, give me the python code ONLY, without additional notes or explanation.
         #pprint.pprint(messages)
         try:
             completion = getOllamaServerClient().chat(
-                keep_alive=config.ollamaMainModel_keep_alive,
+                keep_alive=CallOllama.getKeepAlive(config.ollamaMainModel),
                 model=config.ollamaMainModel,
                 messages=messages,
                 format="json",
                 stream=False,
                 options=Options(
                     temperature=temperature if temperature is not None else config.llmTemperature,
-                    num_ctx=num_ctx if num_ctx is not None else config.ollamaMainModel_num_ctx,
+                    num_ctx=num_ctx if num_ctx is not None else CallOllama.getNumCtx(config.ollamaMainModel, messages, num_predict),
                     num_batch=num_batch if num_batch is not None else config.ollamaMainModel_num_batch,
                     num_predict=num_predict if num_predict is not None else config.ollamaMainModel_num_predict,
                     **config.ollamaMainModel_additional_options,
                 ),
             )
+            CallOllama.reportDurations(completion, config.ollamaMainModel)
             jsonOutput = completion["message"]["content"]
             jsonOutput = re.sub("^[^{]*?({.*?})[^}]*?$", r"\1", jsonOutput)
             responseDict = json.loads(jsonOutput)
@@ -162,20 +252,27 @@ Remember, give me the python code ONLY, without additional notes or explanation.
         # non-streaming single call
         if userInput:
             messages.append({"role": "user", "content" : userInput})
+        if model is None:
+            model = config.ollamaMainModel
+        isChatModel = model == config.ollamaChatModel and not model == config.ollamaMainModel
+        num_predict = getMaxOutputTokens(messages, num_predict if num_predict is not None else config.ollamaChatModel_num_predict if isChatModel else config.ollamaMainModel_num_predict, "ollama", model, CallOllama.getServer(model))
+        if num_predict is None:
+            return ""
         try:
-            completion = getOllamaServerClient().chat(
-                keep_alive=config.ollamaMainModel_keep_alive,
-                model=model if model is not None else config.ollamaMainModel,
+            completion = getOllamaServerClient(CallOllama.getServer(model)).chat(
+                keep_alive=CallOllama.getKeepAlive(model),
+                model=model,
                 messages=messages,
                 stream=False,
                 options=Options(
                     temperature=temperature if temperature is not None else config.llmTemperature,
-                    num_ctx=num_ctx if num_ctx is not None else config.ollamaMainModel_num_ctx,
+                    num_ctx=num_ctx if num_ctx is not None else CallOllama.getNumCtx(model, messages, num_predict),
                     num_batch=num_batch if num_batch is not None else config.ollamaMainModel_num_batch,
-                    num_predict=num_predict if num_predict is not None else config.ollamaMainModel_num_predict,
+                    num_predict=num_predict,
                     **config.ollamaMainModel_additional_options,
                 ),
             )
+            CallOllama.reportDurations(completion, model)
             return completion["message"]["content"]
         except:
             return ""
@@ -354,11 +451,53 @@ Remember, response in JSON with the filled template ONLY.""",
         output = CallOllama.getDictionaryOutput(messages_for_screening, temperature=0.0, num_predict=20)
         return True if "yes" in str(output).lower() else False
 
+    @staticmethod
+    def extractToolParametersSinglePass(schema: dict, userInput: str, ongoingMessages: list = [], temperature: Optional[float]=None, num_ctx: Optional[int]=None, num_batch: Optional[int]=None, num_predict: Optional[int]=None) -> dict:
+        """
+        Extract all action parameters, including code, in one call constrained by the parameter schema
+        Errors are shown here and {} returned, as callers expect parameters
+        """
+        try:
+            messages = getParameterExtractionMessages(schema, userInput, ongoingMessages)
+            num_predict = getMaxOutputTokens(messages, num_predict if num_predict is not None else config.ollamaMainModel_num_predict, "ollama", config.ollamaMainModel)
+            if num_predict is None:
+                return {}
+            completion = getOllamaServerClient().chat(
+                keep_alive=CallOllama.getKeepAlive(config.ollamaMainModel),
+                model=config.ollamaMainModel,
+                messages=messages,
+                # the parameter schema is passed as it is; the client serializes it without changes
+                format=toParameterSchema(schema),
+                stream=False,
+                options=Options(
+                    temperature=temperature if temperature is not None else config.llmTemperature,
+                    num_ctx=num_ctx if num_ctx is not None else CallOllama.getNumCtx(config.ollamaMainModel, messages, num_predict),
+                    num_batch=num_batch if num_batch is not None else config.ollamaMainModel_num_batch,
+                    num_predict=num_predict,
+                    **config.ollamaMainModel_additional_options,
+                ),
+            )
+            CallOllama.reportDurations(completion, config.ollamaMainModel)
+            parameters = json.loads(completion["message"]["content"])
+        except:
+            showErrors()
+            return {}
+        if parameters.get("code", ""):
+            parameters["code"] = extractPythonCode(parameters["code"], keepInvalid=True)
+
+        if config.developer:
+            print2("```parameters")
+            pprint.pprint(parameters)
+            print2("```")
+        return parameters
+
     @staticmethod
     def extractToolParameters(schema: dict, userInput: str, ongoingMessages: list = [], temperature: Optional[float]=None, num_ctx: Optional[int]=None, num_batch: Optional[int]=None, num_predict: Optional[int]=None) -> dict:
         """
         Extract action parameters
         """
+        if config.single_pass_parameter_extraction:
+            return CallOllama.extractToolParametersSinglePass(schema, userInput, ongoingMessages, temperature, num_ctx, num_batch, num_predict)
         schema = toParameterSchema(schema)
         schemaCopy = copy.deepcopy(schema)
 
@@ -1,5 +1,5 @@
 from freegenius import config
-import shutil, os, pprint
+import shutil, os, pprint, json, ast, threading, atexit, copy
 
 pluginExcludeList = [
     "awesome prompts",
@@ -28,13 +28,22 @@ defaultSettings = (
     # unique configs in FreeGenius AI
     ('llmInterface', "llamacpp"), # "llamacpp", "llamacppserver", "ollama", "gemini", "chatgpt", "letmedoit", "groq"
     ('intent_screening', False), # set True to increase both reliability and waiting time
+    ('intent_screening_mode', 'classifier'), # 'classifier': zero-shot classification with zero_shot_classification_model; 'embedding': faster comparison of embeddingModel embeddings with label centroids
     ('tool_dependence', 0.8), # range: 0.0 - 1.0; 0.0 means model's its own capabilities; 1.0; use at least one function call plugin among available tools
     ('tool_auto_selection_threshold', 0.5), # range: 0.0 - 1.0; tool auto selection is implemented when the closest tool match has a semantic distance lower than its value; manual selection from top matched tools is implemented when the closest distance fall between its value and tool_dependence
     ('tool_selection_max_choices', 4), # when tool search distance is higher than tool_auto_selection_threshold but lower than or equal to tool_dependence, manual selection implemented among the top matched tools.  This value specifies the maximum number of choices for manual tool selection in such cases.
+    ('tool_store_embedding_batch_size', 32), # number of tool examples embedded per batch when plugins are loaded; 0 embeds all new tools in a single batch
     ('tokenizers_parallelism', 'true'), # 'true' / 'false'
     ('includeDeviceInfoInContext', False),
+    ('background_warm_up', True), # load llamacpp and ollama models in background at startup, so that the prompt is usable meanwhile
+    ('startup_time_threshold', 0.0), # seconds; with --profile-startup, startup slower than this is reported as a regression; 0 to disable
+    ('config_save_delay', 1.0), # seconds to wait before changed configs are written, so that consecutive changes are saved at once
+    ('cache_friendly_system_message', False), # keep system message first and unchanged across turns, so that backends can reuse cached prompt prefixes; current directory, time and device information are sent in a trailing system message instead
     ('includeIpInDeviceInfo', False),
+    ('device_info_ttl', 3600), # seconds before geolocation and ip addresses in device information are looked up again in background
+    ('device_info_retry_delay', 60), # seconds before a failed geolocation or ip address lookup is tried again
     ('zero_shot_classification_model', 'facebook/bart-large-mnli'),
+    ('zero_shot_classification_preload', True), # load zero-shot classification model in the background at startup when intent_screening is enabled in 'classifier' mode
     ('labels_kind', ("greeting", "translation", "math", "question", "description", "command", "statement", "insturction")),
     ('labels_information', ("common knowledge", "published content", "trained knowledge", "archived records", "historical records", "programming", "technical knowledge", "religious knowledge", "literature", "evolving data", "recent updates", "latest information", "current information", "up-to-date news", "device information", "real-time data")),
     ('labels_action', ("calculation", "writing a text-response", "carrying out a task on your device")),
@@ -57,19 +66,31 @@ defaultSettings = (
     ('ollamaToolServer_port', 11434),
     ('ollamaChatServer_port', 11434),
     ('ollamaVisionServer_port', 11434),
+    ('context_window_buckets', [2048, 4096, 8192, 16384, 32768, 65536, 131072]), # context window sizes used in "auto" context mode; a model is reloaded only when a larger size is needed
+    ('minimum_output_tokens', 256), # requests to non-OpenAI backends are not sent if fewer tokens are left for output in the context window
+    ('context_window_output_tokens', 2048), # output tokens reserved in "auto" context mode, when maximum output tokens are not limited
+    ('compaction_token_threshold', 0), # turns older than the last compaction_keep_turns are replaced with a summary once a chat reaches this number of tokens; 0: 75% of the context window of the model in use; -1: disabled
+    ('compaction_keep_turns', 4), # recent turns kept verbatim when a chat is compacted
+    ('single_pass_parameter_extraction', False), # llamacpp and ollama: extract all tool parameters, including code, in one call constrained by the tool parameter schema, instead of generating code and filling a JSON template in separate calls; ollama requires server version 0.5 or later
+    ('max_parallel_tool_calls', 4), # letmedoit: maximum number of tool calls, returned in a single response, that run concurrently; 1 runs tool calls one by one
+    ('streaming_refresh_interval', 0.016), # seconds between terminal updates when streaming output; output is also written on every new line; 0 writes every chunk immediately
     ('ollamaVisionModel', 'llava'), # ollama model used for vision
     ('ollamaMainModel', 'codellama:7b-instruct'), # ollama model used for both task execution and conversation
     ('ollamaMainModel_additional_options', {}),
     ('ollamaChatModel_additional_options', {}),
-    ('ollamaMainModel_num_ctx', 100000), # ollama main model context window
+    ('ollamaMainModel_num_ctx', "auto"), # ollama main model context window; "auto" to size it from messages, with context_window_buckets
     ('ollamaMainModel_num_batch', 512), # ollama chat model batch size
     ('ollamaMainModel_num_predict', -1), # ollama main model maximum tokens
     ('ollamaMainModel_keep_alive', "5m"), # ollama main model keep alive time
     ('ollamaChatModel', 'mistral'), # ollama model used for chat
-    ('ollamaChatModel_num_ctx', 100000), # ollama chat model context window
+    ('ollamaChatModel_num_ctx', "auto"), # ollama chat model context window; "auto" to size it from messages, with context_window_buckets
     ('ollamaChatModel_num_batch', 512), # ollama chat model batch size
     ('ollamaChatModel_num_predict', -1), # ollama chat model maximum tokens
     ('ollamaChatModel_keep_alive', "5m"), # ollama chat model keep alive time
+    ('ollamaVisionModel_keep_alive', "5m"), # ollama vision model keep alive time
+    ('ollamaModels_keep_alive', {}), # keep alive time of individual ollama models, e.g. {"llava": "30m"}; overrides the settings above
+    ('ollamaPinnedModels', []), # ollama models kept loaded indefinitely; use action '.pin' to pin or unpin a model
+    ('ollamaPreloadModels', True), # load ollama main, chat and vision models at startup, so that the first request does not wait for model loading
     ('llamacppMainModel_verbose', False),
     ('llamacppChatModel_verbose', False),
     ('llamacppVisionModel_verbose', False),
@@ -91,6 +112,8 @@ defaultSettings = (
     ('llamacppVisionModel_additional_model_options', {}),
     ('llamacppVisionModel_additional_chat_options', {}),
     ('llamacppVisionModel_max_tokens', 10000), # llama.cpp vision model maximum tokens
+    ('image_cache_capacity', 33554432), # maximum size of encoded images kept for follow-up questions, in bytes; 0 to disable
+    ('llamacppVisionModel_idle_timeout', 300), # seconds of inactivity before the resident llama.cpp vision model is unloaded; 0 keeps it loaded until '.unloadvision'
     ('llamacppVisionModel_n_gpu_layers', 0), # -1 automatic if gpu is in place
     ('llamacppVisionModel_n_batch', 512),
     ('llamacppVisionModel_n_ctx', 0),
@@ -104,10 +127,12 @@ defaultSettings = (
     ('llamacppMainModel_model_path', ''), # specify file path of llama.cpp model for general purpose
     ('llamacppMainModel_repo_id', 'TheBloke/CodeLlama-7B-Instruct-GGUF'), # llama.cpp model used for both task execution and conversation, e.g. 'TheBloke/phi-2-GGUF', 'NousResearch/Hermes-2-Pro-Mistral-7B-GGUF', 'NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO-GGUF'
     ('llamacppMainModel_filename', 'codellama-7b-instruct.Q4_K_M.gguf'), # llama.cpp model used for both task execution and conversation, e.g. 'Hermes-2-Pro-Mistral-7B.Q4_K_M.gguf', 'Nous-Hermes-2-Mixtral-8x7B-DPO.Q4_K_M.gguf'
-    ('llamacppMainModel_n_ctx', 0), # llama.cpp main model context window
+    ('llamacppMainModel_n_ctx', 0), # llama.cpp main model context window; 0 to use the model's training context; "auto" to size it from messages, with context_window_buckets
     ('llamacppMainModel_max_tokens', 10000), # llama.cpp main model maximum tokens
     ('llamacppMainModel_n_gpu_layers', 0), # change to -1 to use GPU acceleration
     ('llamacppMainModel_n_batch', 512), # The batch size to use per eval
+    ('llamacppMainModel_cache_type', ''), # '' disables prompt state cache; 'ram' or 'disk' caches evaluated prompt prefixes of llama.cpp main model
+    ('llamacppMainModel_cache_capacity', 2147483648), # maximum size of llama.cpp main model prompt state cache, in bytes
     ('llamacppChatModel_ollama_tag', ''), # selected ollama hosted model to run with llamacpp
     ('llamacppChatModel_model_path', ''), # specify file path of llama.cpp model for chat
     ('llamacppChatModel_repo_id', 'TheBloke/Mistral-7B-Instruct-v0.2-GGUF'), # llama.cpp model used for chat, e.g. 'TheBloke/CodeLlama-7B-Python-GGUF'
@@ -138,6 +163,7 @@ defaultSettings = (
     ('systemMessage_palm2', 'You are a helpful, uncensored and unbiased assistant.'), # system message for standalone palm2 chatbot
     ('systemMessage_codey', 'You are an expert on coding.'), # system message for standalone codey chatbot
     ('embeddingModel', 'paraphrase-multilingual-mpnet-base-v2'), # reference: https://www.sbert.net/docs/pretrained_models.html
+    ('embeddingDevice', 'cpu'), # device that runs Sentence Transformer embedding models, e.g. 'cpu', 'cuda', 'mps'
     ('customTextEditor', ""), # e.g. 'micro -softwrap true -wordwrap true'; built-in text editor eTextEdit is used when it is not defined.
     ('pagerView', False),
     ('usePygame', False), # force to use pygame for audio playback even VLC player is installed
@@ -276,6 +302,7 @@ temporaryConfigs = [
     "geminipro_safety_settings",
     "llamacppMainModel",
     "llamacppChatModel",
+    "llamacppVisionModel",
     "new_chat_response",
     "runPython",
     "freeGeniusActions",
@@ -294,6 +321,7 @@ temporaryConfigs = [
     "pluginsWithFunctionCall",
     "restartApp",
     "saveConfig",
+    "flushConfig",
     "aliases",
     "addPathAt",
     "multilineInput",
@@ -333,6 +361,11 @@ temporaryConfigs = [
     # used with plugins; function call
     "toolFunctionSchemas",
     "toolFunctionMethods",
+    "lazyTools",
+    "concurrentTools",
+    "toolStoreIds",
+    "toolStorePending",
+    "toolStoreReport",
     "pythonFunctionResponse", # used with plugins; function call when function name is 'python'
     # FreeGenius methods shared from Class FreeGenius
     "getLocalStorage",
@@ -346,17 +379,118 @@ temporaryConfigs = [
     "isTermux",
 ]
 
+# configs are stored in config.json; values that json cannot represent, e.g. tuples, are stored as python literals
+# saveConfig only records changed configs; they are written once after config.config_save_delay seconds, via a temporary file and a rename
+# only changed configs are serialized; a write is skipped when no persistent config changed
+
+configLock = threading.RLock()
+# persisted: serialized configs in config.json; values: configs as last checked; dirty: persistent configs changed since last write
+configState = {"timer": None, "persisted": None, "values": {}, "dirty": set()}
+
+def getConfigFile():
+    return os.path.join(config.freeGeniusAIFolder, "config.json")
+
+def encodeConfigValue(value):
+    try:
+        if json.loads(json.dumps(value)) == value:
+            return value
+    except:
+        pass
+    literal = pprint.pformat(value)
+    if ast.literal_eval(literal) == value:
+        return {"__literal__": literal}
+    raise ValueError(f"Unsupported config value: {literal}")
+
+def decodeConfigValue(value):
+    if isinstance(value, dict) and len(value) == 1 and "__literal__" in value:
+        return ast.literal_eval(value["__literal__"])
+    return value
+
+def snapshotConfigValue(value):
+    # containers are copied, so that changes made in place are noticed
+    return copy.deepcopy(value) if isinstance(value, (list, dict, set)) else value
+
+def isSameConfigValue(value1, value2) -> bool:
+    try:
+        return type(value1) is type(value2) and bool(value1 == value2)
+    except:
+        return False
+
+def markChangedConfigs() -> set:
+    """
+    record persistent configs changed since last check; values are compared, not serialized
+    """
+    with configLock:
+        excludeConfigList = set(temporaryConfigs + config.excludeConfigList)
+        values, dirty = configState["values"], configState["dirty"]
+        names = set()
+        for name in dir(config):
+            if name.startswith("__") or name in excludeConfigList:
+                continue
+            names.add(name)
+            value = getattr(config, name)
+            if name in values and isSameConfigValue(values[name], value):
+                continue
+            values[name] = snapshotConfigValue(value)
+            if not callable(value) and not str(value).startswith("<"):
+                dirty.add(name)
+        # removed configs
+        for name in [name for name in values if not name in names]:
+            del values[name]
+            dirty.add(name)
+        return dirty
+
+def loadJsonConfig(configFile):
+    with open(configFile, "r", encoding="utf-8") as fileObj:
+        configs = json.load(fileObj)
+    with configLock:
+        for name, value in configs.items():
+            value = decodeConfigValue(value)
+            setattr(config, name, value)
+            configState["values"][name] = snapshotConfigValue(value)
+        configState["persisted"] = {name: json.dumps(value, ensure_ascii=False) for name, value in configs.items()}
+
+def flushConfig():
+    with configLock:
+        if configState["timer"] is not None:
+            configState["timer"].cancel()
+            configState["timer"] = None
+        dirty = markChangedConfigs()
+        configState["dirty"] = set()
+        configs = dict(configState["persisted"] or {})
+        changed = False
+        for name in dirty:
+            if not hasattr(config, name):
+                changed = configs.pop(name, None) is not None or changed
+                continue
+            try:
+                value = json.dumps(encodeConfigValue(getattr(config, name)), ensure_ascii=False)
+            except:
+                continue
+            if not configs.get(name) == value:
+                configs[name] = value
+                changed = True
+        if not changed:
+            # no persistent config is changed since last write
+            return None
+        configFile = getConfigFile()
+        tempFile = f"{configFile}.tmp"
+        with open(tempFile, "w", encoding="utf-8") as fileObj:
+            fileObj.write("{\n" + ",\n".join(f"    {json.dumps(name)}: {value}" for name, value in sorted(configs.items())) + "\n}\n")
+            fileObj.flush()
+            os.fsync(fileObj.fileno())
+        os.replace(tempFile, configFile)
+        configState["persisted"] = configs
+
 def saveConfig():
     if not config.tempInterface:
-        configFile = os.path.join(config.freeGeniusAIFolder, "config.py")
-        with open(configFile, "w", encoding="utf-8") as fileObj:
-            for name in dir(config):
-                excludeConfigList = temporaryConfigs + config.excludeConfigList
-                if not name.startswith("__") and not name in excludeConfigList:
-                    try:
-                        value = eval(f"config.{name}")
-                        if not callable(value) and not str(value).startswith("<"):
-                            fileObj.write("{0} = {1}\n".format(name, pprint.pformat(value)))
-                    except:
-                        pass
-config.saveConfig = saveConfig
\ No newline at end of file
+        with configLock:
+            if markChangedConfigs() and configState["timer"] is None:
+                configState["timer"] = threading.Timer(config.config_save_delay, flushConfig)
+                configState["timer"].daemon = True
+                configState["timer"].start()
+
+config.saveConfig = saveConfig
+config.flushConfig = flushConfig
+# write pending changes on exit
+atexit.register(lambda: None if config.tempInterface else flushConfig())
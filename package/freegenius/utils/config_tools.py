@@ -1,9 +1,12 @@
 from freegenius import config
 import pprint, re, os, shutil
-from freegenius.utils.config_essential import defaultSettings
+from freegenius.utils.config_essential import defaultSettings, getConfigFile, loadJsonConfig, flushConfig
 from prompt_toolkit.shortcuts import yes_no_dialog
 
 def loadConfig(configPath):
+    if configPath.endswith(".json"):
+        return loadJsonConfig(configPath)
+    # configs saved in python format, by earlier versions
     with open(configPath, "r", encoding="utf-8") as fileObj:
         configs = fileObj.read()
     configs = "from freegenius import config\n" + re.sub("^([A-Za-z])", r"config.\1", configs, flags=re.M)
@@ -21,12 +24,22 @@ def setConfig(defaultSettings, thisTranslation={}, temporary=False):
             if not i in config.thisTranslation:
                 config.thisTranslation[i] = thisTranslation[i]
 
+def hasLegacyConfigs() -> bool:
+    with open(legacyConfigFile, "r", encoding="utf-8") as fileObj:
+        return not fileObj.read() in ("", legacyConfigMarker)
+
 storageDir = config.localStorage
 
+# configs are stored in config.json; config.py is read only to migrate configs saved by earlier versions
+legacyConfigFile = os.path.join(config.freeGeniusAIFolder, "config.py")
+configFile = getConfigFile()
+migrateConfig = False
+# marker written into config.py once configs are in config.json; an installation empties config.py again
+legacyConfigMarker = "# configs are moved to config.json\n"
+
 # restore configs from backup
 if os.path.isdir(storageDir):
-    configFile = os.path.join(config.freeGeniusAIFolder, "config.py")
-    if os.path.getsize(configFile) == 0:
+    if os.path.getsize(legacyConfigFile) == 0:
         # It means that it is either a newly installed copy or an upgraded copy
         
         # delete old shortcut files so that newer versions of shortcuts can be created
@@ -40,9 +53,11 @@ if os.path.isdir(storageDir):
         shortcut_dir = os.path.join(config.freeGeniusAIFolder, "shortcuts")
         shutil.rmtree(shortcut_dir, ignore_errors=True)
 
-        # check if config backup is available
-        backupFile = os.path.join(storageDir, "config_backup.py")
-        if os.path.isfile(backupFile):
+        # check if config backup is available; configs in config.json are kept over an upgrade, so that no backup is needed
+        backupFile = os.path.join(storageDir, "config_backup.json")
+        if not os.path.isfile(backupFile):
+            backupFile = os.path.join(storageDir, "config_backup.py")
+        if not os.path.isfile(configFile) and os.path.isfile(backupFile):
             restore_backup = yes_no_dialog(
                 title="Configuration Backup Found",
                 text=f"Do you want to use the following backup?\n{backupFile}"
@@ -50,11 +65,30 @@ if os.path.isdir(storageDir):
             if restore_backup:
                 try:
                     loadConfig(backupFile)
-                    shutil.copy(backupFile, configFile)
+                    if backupFile.endswith(".json"):
+                        shutil.copy(backupFile, configFile)
+                    else:
+                        migrateConfig = True
                     print("Configuration backup restored!")
                     #config.restartApp()
                 except:
                     print("Failed to restore backup!")
+        # mark the installation as handled
+        if not config.tempInterface:
+            with open(legacyConfigFile, "w", encoding="utf-8") as fileObj:
+                fileObj.write(legacyConfigMarker)
+
+if os.path.isfile(configFile):
+    loadConfig(configFile)
+elif os.path.isfile(legacyConfigFile) and hasLegacyConfigs():
+    # configs in config.py are already loaded when config module is imported
+    migrateConfig = True
 
 # load new / unsaved configs
 setConfig(defaultSettings)
+
+# migrate configs from config.py to config.json
+if migrateConfig and not config.tempInterface:
+    flushConfig()
+    with open(legacyConfigFile, "w", encoding="utf-8") as fileObj:
+        fileObj.write(legacyConfigMarker)
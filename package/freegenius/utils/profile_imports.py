@@ -0,0 +1,31 @@
+import subprocess, sys, re, time
+
+# print a table of import times, sorted by cumulative time, to find dependencies that slow down startup
+# usage: python -m freegenius.utils.profile_imports [--profile-imports] [module] [rows]
+
+def profileImports(module: str="freegenius.main", rows: int=30) -> list:
+    start = time.perf_counter()
+    # -X importtime reports every import to stderr, in the order imports are completed
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    timings = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"^import time:\s+([0-9]+) \|\s+([0-9]+) \|( *)(\S+)$", line)
+        if match:
+            selfTime, cumulativeTime, indent, name = match.groups()
+            # the least indented entries are imported directly by the profiled module or the interpreter
+            timings.append((int(cumulativeTime), int(selfTime), len(indent), name))
+    if not timings:
+        print(result.stderr)
+        return []
+    topLevel = min(i[2] for i in timings)
+    timings = sorted((i for i in timings if i[2] == topLevel), reverse=True)
+    print(f"{'cumulative (ms)':>16} {'self (ms)':>10}  module")
+    for cumulativeTime, selfTime, _, name in timings[:rows]:
+        print(f"{cumulativeTime / 1000:>16.1f} {selfTime / 1000:>10.1f}  {name}")
+    print(f"Importing '{module}' took {elapsed:.2f}s, including interpreter startup.")
+    return timings
+
+if __name__ == '__main__':
+    args = [i for i in sys.argv[1:] if not i == "--profile-imports"]
+    profileImports(*args[:1], *[int(i) for i in args[1:2]])
@@ -1,9 +1,13 @@
-from freegenius import config, count_tokens_from_messages, count_tokens_from_functions, tokenLimits
+from freegenius import config, count_tokens_from_messages, countToolSchemaTokens, getTokenEncoding, tokenLimits
 from prompt_toolkit.validation import Validator, ValidationError
 from prompt_toolkit.application import run_in_terminal
-import tiktoken
+import functools
 import re
 
+@functools.lru_cache(maxsize=16)
+def countPredefinedContextTokens(context: str, model: str) -> int:
+    return len(getTokenEncoding(model).encode(f"{context}\n<content></content>"))
+
 class TokenValidator(Validator):
     def validate(self, document):
         #current_buffer = get_app().current_buffer
@@ -11,10 +15,8 @@ class TokenValidator(Validator):
         if not config.dynamicTokenCount or not currentInput or currentInput.lower() in (config.exit_entry, config.cancel_entry, ".new", ".share", ".save"):
             pass
         else:
-            try:
-                encoding = tiktoken.encoding_for_model(config.chatGPTApiModel)
-            except:
-                encoding = tiktoken.get_encoding("cl100k_base")
+            # encoder, message and tool schema token counts are cached; only the current input is tokenized on each keystroke
+            encoding = getTokenEncoding(config.chatGPTApiModel)
             no_function_call_pattern = "\[NO_TOOL\]|\[CHAT\]|\[CHAT_[^\[\]]+?\]"
             #if "[NO_TOOL]" in currentInput:
             if re.search(no_function_call_pattern, currentInput):
@@ -22,8 +24,8 @@ class TokenValidator(Validator):
                 #currentInput = currentInput.replace("[NO_TOOL]", "")
                 currentInput = re.sub(no_function_call_pattern, "", currentInput)
             else:
-                availableFunctionTokens = count_tokens_from_functions(config.toolFunctionSchemas)
-            currentInputTokens = len(encoding.encode(config.fineTuneUserInput(currentInput)))
+                availableFunctionTokens = countToolSchemaTokens()
+            currentInputTokens = len(encoding.encode(currentInput)) + self.getContextTokens()
             loadedMessageTokens = count_tokens_from_messages(config.currentMessages)
             selectedModelLimit = tokenLimits[config.chatGPTApiModel]
             #estimatedAvailableTokens = selectedModelLimit - availableFunctionTokens - loadedMessageTokens - currentInputTokens
@@ -37,6 +39,14 @@ class TokenValidator(Validator):
                 run_in_terminal(lambda: print(f"""Press '{str(config.hotkey_new).replace("'", "")[1:-1]}' to start a new chat!"""))
                 raise ValidationError(message='Token limit reached!', cursor_position=document.cursor_position)
 
+    @staticmethod
+    def getContextTokens() -> int:
+        # tokens of predefined context, added to user input by fineTuneUserInput
+        context = config.customPredefinedContext if config.predefinedContext == "[custom]" else config.predefinedContexts.get(config.predefinedContext, "")
+        if context and (not config.conversationStarted or config.applyPredefinedContextAlways):
+            return countPredefinedContextTokens(context, config.chatGPTApiModel)
+        return 0
+
 class NumberValidator(Validator):
     def validate(self, document):
         text = document.text
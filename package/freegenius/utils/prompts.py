@@ -1,6 +1,6 @@
 from freegenius import config, getDeviceInfo, restartApp, count_tokens_from_messages, isCommandInstalled, getCpuThreads
-from freegenius import print1, print2, print3, count_tokens_from_functions, tokenLimits
-import pydoc, textwrap, re, tiktoken, os, subprocess
+from freegenius import print1, print2, print3, countToolSchemaTokens, getTokenEncoding, tokenLimits
+import pydoc, textwrap, re, os, subprocess
 import speech_recognition as sr
 from prompt_toolkit import prompt
 from prompt_toolkit.application import run_in_terminal
@@ -203,10 +203,7 @@ class Prompts:
         @this_key_bindings.add(*config.hotkey_count_tokens)
         def _(event):
             try:
-                try:
-                    encoding = tiktoken.encoding_for_model(config.chatGPTApiModel)
-                except:
-                    encoding = tiktoken.get_encoding("cl100k_base")
+                encoding = getTokenEncoding(config.chatGPTApiModel)
                 currentInput = event.app.current_buffer.text
                 no_function_call_pattern = "\[NO_TOOL\]|\[CHAT\]|\[CHAT_[^\[\]]+?\]"
                 #if "[NO_TOOL]" in currentInput:
@@ -215,7 +212,7 @@ class Prompts:
                     #currentInput = currentInput.replace("[NO_TOOL]", "")
                     currentInput = re.sub(no_function_call_pattern, "", currentInput)
                 else:
-                    availableFunctionTokens = count_tokens_from_functions(config.toolFunctionSchemas)
+                    availableFunctionTokens = countToolSchemaTokens()
                 currentInputTokens = len(encoding.encode(config.fineTuneUserInput(currentInput)))
                 loadedMessageTokens = count_tokens_from_messages(config.currentMessages)
                 selectedModelLimit = tokenLimits[config.chatGPTApiModel]
@@ -404,7 +401,7 @@ Available tokens: {estimatedAvailableTokens}
         else:
             print(keyHelp)
 
-    def simplePrompt(self, numberOnly=False, validator=None, inputIndicator="", default="", accept_default=False, completer=None, promptSession=None, style=None, is_password=False, bottom_toolbar=None):
+    def simplePrompt(self, numberOnly=False, validator=None, inputIndicator="", default="", accept_default=False, completer=None, promptSession=None, style=None, is_password=False, bottom_toolbar=None, refresh_interval=None):
         config.selectAll = False
         inputPrompt = promptSession.prompt if promptSession is not None else prompt
         if not inputIndicator:
@@ -426,6 +423,7 @@ Available tokens: {estimatedAvailableTokens}
             is_password=is_password,
             mouse_support=Condition(lambda: config.mouseSupport),
             clipboard=config.clipboard,
+            refresh_interval=refresh_interval,
         )
         userInput = textwrap.dedent(userInput) # dedent to work with code block
         return userInput if hasattr(config, "addPathAt") and config.addPathAt else userInput.strip()
@@ -1,68 +1,182 @@
 from freegenius import config
 from freegenius.utils.terminal_mode_dialogs import TerminalModeDialogs
-import sys, os, geocoder, platform, socket, geocoder, datetime, requests, netifaces, getpass, pendulum, pkg_resources, webbrowser, unicodedata
-import traceback, uuid, re, textwrap, signal, wcwidth, shutil, threading, time, tiktoken, subprocess, json, base64, html2text, pydoc, codecs, psutil
+import sys, os, platform, socket, datetime, requests, netifaces, getpass, webbrowser, unicodedata, importlib
+import traceback, uuid, re, textwrap, signal, wcwidth, shutil, threading, time, subprocess, json, base64, pydoc, codecs, psutil, functools, hashlib
+from collections import OrderedDict
 from packaging import version
-from chromadb.utils import embedding_functions
 from pygments.styles import get_style_by_name
 from prompt_toolkit.styles.pygments import style_from_pygments_cls
 from prompt_toolkit import print_formatted_text, HTML
 from prompt_toolkit import prompt
 from typing import Optional, Any
-from vertexai.generative_models import Content, Part
 from pathlib import Path
-from PIL import Image
-from openai import OpenAI
-from huggingface_hub import hf_hub_download
-from bs4 import BeautifulSoup
 from urllib.parse import quote
-from guidance import select, gen
 from typing import Union
-from transformers import pipeline
-from groq import Groq
-from ollama import Client
 
 
+# lazy imports
+
+class LazyImport:
+    """
+    proxy of a heavy dependency, imported on first use rather than at startup
+    e.g. LazyImport("tiktoken") for "import tiktoken"; LazyImport("groq", "Groq") for "from groq import Groq"
+    """
+
+    def __init__(self, module: str, name: Optional[str]=None):
+        self._module = module
+        self._name = name
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    target = importlib.import_module(self._module)
+                    self._target = getattr(target, self._name) if self._name else target
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __contains__(self, item):
+        return item in self._load()
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        return f"<lazy import '{self._module}{f'.{self._name}' if self._name else ''}'>"
+
+geocoder = LazyImport("geocoder")
+pendulum = LazyImport("pendulum")
+pkg_resources = LazyImport("pkg_resources")
+tiktoken = LazyImport("tiktoken")
+html2text = LazyImport("html2text")
+numpy = LazyImport("numpy")
+embedding_functions = LazyImport("chromadb.utils.embedding_functions")
+Content = LazyImport("vertexai.generative_models", "Content")
+Part = LazyImport("vertexai.generative_models", "Part")
+Image = LazyImport("PIL.Image")
+OpenAI = LazyImport("openai", "OpenAI")
+hf_hub_download = LazyImport("huggingface_hub", "hf_hub_download")
+BeautifulSoup = LazyImport("bs4", "BeautifulSoup")
+select = LazyImport("guidance", "select")
+gen = LazyImport("guidance", "gen")
+pipeline = LazyImport("transformers", "pipeline")
+Groq = LazyImport("groq", "Groq")
+Client = LazyImport("ollama", "Client")
+
 # non-Android only
 if not config.isTermux:
-    from autogen.retrieve_utils import TEXT_FORMATS
+    TEXT_FORMATS = LazyImport("autogen.retrieve_utils", "TEXT_FORMATS")
 
-# a dummy import line to resolve ALSA error display on Linux
-import sounddevice
+# sounddevice, imported to resolve ALSA error display on Linux, is imported in prompts.py, where speech recognition is used
 
 # transformers
 
+# zero-shot classification pipelines, loaded once and kept resident
+zeroShotClassifiers = {}
+zeroShotClassifierLock = threading.Lock()
+
+def getZeroShotClassifier():
+    with zeroShotClassifierLock:
+        if not config.zero_shot_classification_model in zeroShotClassifiers:
+            zeroShotClassifiers[config.zero_shot_classification_model] = pipeline(task="zero-shot-classification", model=config.zero_shot_classification_model)
+        return zeroShotClassifiers[config.zero_shot_classification_model]
+
+def preloadZeroShotClassifier():
+    # load the classifier in the background, so that the prompt is not blocked
+    threading.Thread(target=getZeroShotClassifier, daemon=True).start()
+
 def classify(user_input, candidate_labels):
-    classifier = pipeline(task="zero-shot-classification", model=config.zero_shot_classification_model)
-    response = classifier(
+    response = getZeroShotClassifier()(
         user_input,
         candidate_labels=candidate_labels,
     )
     labels = response["labels"]
     return labels[0]
 
-def isToolRequired(user_input) -> bool:
+def classifyMany(user_input, labelSets) -> list:
+    """
+    score all label sets in a single batched forward pass and return the top label of each set
+    the top label of each set is the same as that returned by classify, as scores are softmax of entailment logits
+    """
+    candidate_labels = list(dict.fromkeys(label for labels in labelSets for label in labels))
+    response = getZeroShotClassifier()(
+        user_input,
+        candidate_labels=candidate_labels,
+        batch_size=len(candidate_labels),
+    )
+    scores = dict(zip(response["labels"], response["scores"]))
+    return [max(labels, key=lambda label: scores[label]) for labels in labelSets]
+
+def isToolRequired(user_input, display=True) -> bool:
+    if config.intent_screening_mode == "embedding":
+        return isToolRequiredByEmbedding(user_input, display=display)
     tool = True
-    print2("```screening")
-    # check the kind of input
-    kind = classify(user_input, config.labels_kind)
-    print3(f"Kind: {kind}")
+    if display:
+        print2("```screening")
+    # check the kind of input, the nature of requested information and the nature of requested response at once
+    kind, information, action = classifyMany(user_input, (config.labels_kind, config.labels_information, config.labels_action))
+    if display:
+        print3(f"Kind: {kind}")
     if kind in config.labels_kind_chat_only_options:
         tool = False
     elif kind in config.labels_kind_information_options:
         # check the nature of the requested information
-        information = classify(user_input, config.labels_information)
-        print3(f"Information: {information}")
+        if display:
+            print3(f"Information: {information}")
         if information in config.labels_information_chat_only_options:
             tool = False
     else:
         # check the nature of the requested response
-        action = classify(user_input, config.labels_action)
-        print3(f"Action: {action}")
+        if display:
+            print3(f"Action: {action}")
         if action in config.labels_action_chat_only_options:
             tool = False
-    print3(f"""Comment: Tool may {"" if tool else "not "}be required.""")
-    print2("```")
+    if display:
+        print3(f"""Comment: Tool may {"" if tool else "not "}be required.""")
+        print2("```")
+    return tool
+
+# embedding-based intent screening
+
+# normalized centroids of chat-only and tool-requiring labels, computed once per embedding model and label sets
+intentCentroids = {}
+
+def getIntentCentroids():
+    chatLabels = list(config.labels_kind_chat_only_options) + list(config.labels_information_chat_only_options) + list(config.labels_action_chat_only_options)
+    toolLabels = [i for i in config.labels_information if not i in config.labels_information_chat_only_options] + [i for i in config.labels_action if not i in config.labels_action_chat_only_options]
+    key = (config.embeddingModel, json.dumps([chatLabels, toolLabels]))
+    if not key in intentCentroids:
+        embeddings = numpy.array(getEmbeddingFunction()([f"This request is about {i}." for i in chatLabels + toolLabels]), dtype=float)
+        embeddings /= numpy.linalg.norm(embeddings, axis=1, keepdims=True)
+        centroids = numpy.stack((embeddings[:len(chatLabels)].mean(axis=0), embeddings[len(chatLabels):].mean(axis=0)))
+        intentCentroids[key] = centroids / numpy.linalg.norm(centroids, axis=1, keepdims=True)
+    return intentCentroids[key]
+
+def isToolRequiredByEmbedding(user_input, display=True) -> bool:
+    """
+    a single embedding of user input is compared with the chat-only and tool-requiring centroids
+    """
+    embedding = numpy.array(getEmbeddingFunction()([user_input])[0], dtype=float)
+    chatSimilarity, toolSimilarity = getIntentCentroids() @ (embedding / numpy.linalg.norm(embedding))
+    tool = bool(toolSimilarity > chatSimilarity)
+    if display:
+        print2("```screening")
+        print3(f"Similarity: chat-only {chatSimilarity:.4f}; tool {toolSimilarity:.4f}")
+        print3(f"""Comment: Tool may {"" if tool else "not "}be required.""")
+        print2("```")
     return tool
 
 # guidance
@@ -189,8 +303,39 @@ def getGroqApi_key():
     else:
         return ""
 
+# backend clients shared across calls, keyed by (backend, host, port, api key)
+# reusing a client reuses its pool of keep-alive HTTP connections; a new client is created only when the relevant configs change
+backendClients = {}
+# lookups served by an existing client, by client key; see showBackendClients
+backendClientReuses = {}
+backendClientLock = threading.Lock()
+
+def getBackendClient(backend, host, port, api_key, createClient):
+    key = (backend, host, port, api_key)
+    with backendClientLock:
+        if not key in backendClients:
+            backendClients[key] = createClient()
+            backendClientReuses[key] = 0
+            if config.developer:
+                print3(f"Client created: {backend} {host}{f':{port}' if port else ''}")
+        else:
+            backendClientReuses[key] += 1
+        return backendClients[key]
+
+def showBackendClients():
+    with backendClientLock:
+        if not backendClients:
+            print2("No backend client is created yet!")
+            return None
+        print2("```clients")
+        for (backend, host, port, _), reuses in backendClientReuses.items():
+            # api keys are not shown
+            print(f"{backend} {host}{f':{port}' if port else ''}: reused {reuses} time(s)")
+        print2("```")
+
 def getGroqClient():
-    return Groq(api_key=getGroqApi_key())
+    api_key = getGroqApi_key()
+    return getBackendClient("groq", "api.groq.com", None, api_key, lambda: Groq(api_key=api_key))
 
 def downloadStableDiffusionFiles():
     # llm directory
@@ -250,13 +395,20 @@ def stopAutogenstudioServer():
         config.autogenstudioServer = None
 
 def getOllamaServerClient(server="main"):
-    return Client(host=f"http://{config.ollamaChatServer_ip if server=='chat' else config.ollamaToolServer_ip}:{config.ollamaChatServer_port if server=='chat' else config.ollamaToolServer_port}")
+    if server == "vision":
+        host, port = config.ollamaVisionServer_ip, config.ollamaVisionServer_port
+    else:
+        host = config.ollamaChatServer_ip if server=='chat' else config.ollamaToolServer_ip
+        port = config.ollamaChatServer_port if server=='chat' else config.ollamaToolServer_port
+    return getBackendClient("ollama", host, port, "", lambda: Client(host=f"http://{host}:{port}"))
 
 def getLlamacppServerClient(server="main"):
-    return OpenAI(
-        base_url=f"http://{config.customChatServer_ip if server=='chat' else config.customToolServer_ip}:{config.customChatServer_port if server=='chat' else config.customToolServer_port}/v1",
+    host = config.customChatServer_ip if server=='chat' else config.customToolServer_ip
+    port = config.customChatServer_port if server=='chat' else config.customToolServer_port
+    return getBackendClient("llamacppserver", host, port, "freegenius", lambda: OpenAI(
+        base_url=f"http://{host}:{port}/v1",
         api_key = "freegenius"
-    )
+    ))
 
 def startLlamacppServer():
     try:
@@ -264,7 +416,7 @@ def startLlamacppServer():
             config.llamacppServer = None
             print2("Running llama.cpp tool server ...")
             cpuThreads = getCpuThreads()
-            cmd = f"""{sys.executable} -m llama_cpp.server --port {config.llamacppMainModel_server_port} --model "{config.llamacppMainModel_model_path}" --verbose {config.llamacppMainModel_verbose} --chat_format chatml --n_ctx {config.llamacppMainModel_n_ctx} --n_gpu_layers {config.llamacppMainModel_n_gpu_layers} --n_batch {config.llamacppMainModel_n_batch} --n_threads {cpuThreads} --n_threads_batch {cpuThreads} {config.llamacppMainModel_additional_server_options}"""
+            cmd = f"""{sys.executable} -m llama_cpp.server --port {config.llamacppMainModel_server_port} --model "{config.llamacppMainModel_model_path}" --verbose {config.llamacppMainModel_verbose} --chat_format chatml --n_ctx {0 if config.llamacppMainModel_n_ctx == "auto" else config.llamacppMainModel_n_ctx} --n_gpu_layers {config.llamacppMainModel_n_gpu_layers} --n_batch {config.llamacppMainModel_n_batch} --n_threads {cpuThreads} --n_threads_batch {cpuThreads} {config.llamacppMainModel_additional_server_options}"""
             config.llamacppServer = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, preexec_fn=os.setsid)
             while not isServerAlive("127.0.0.1", config.llamacppMainModel_server_port):
                 # wait til the server is up
@@ -630,11 +782,31 @@ def getLocalStorage():
 
 # image
 
+# data uris of recently encoded images, by content hash and extension, evicted in LRU order once they exceed config.image_cache_capacity bytes
+imageCache = OrderedDict()
+imageCacheState = {"size": 0}
+imageCacheLock = threading.Lock()
+
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+        image = image_file.read()
     ext = os.path.splitext(os.path.basename(image_path))[1][1:]
-    return f"data:image/{ext};base64,{base64_image}"
+    # keyed by content, so that an edited image is encoded again and a copy of an image is not
+    key = (hashlib.sha256(image).hexdigest(), ext)
+    with imageCacheLock:
+        if key in imageCache:
+            imageCache.move_to_end(key)
+            return imageCache[key]
+    base64_image = base64.b64encode(image).decode('utf-8')
+    data_uri = f"data:image/{ext};base64,{base64_image}"
+    with imageCacheLock:
+        if not key in imageCache and len(data_uri) <= config.image_cache_capacity:
+            imageCache[key] = data_uri
+            imageCacheState["size"] += len(data_uri)
+            while imageCacheState["size"] > config.image_cache_capacity:
+                _, evicted = imageCache.popitem(last=False)
+                imageCacheState["size"] -= len(evicted)
+    return data_uri
 
 def is_valid_image_url(url): 
     try: 
@@ -685,6 +857,40 @@ def toParameterSchema(schema) -> dict:
         return schema["parameters"]
     return schema
 
+def getParameterExtractionMessages(schema: dict, userInput: str, ongoingMessages: list=[]) -> list:
+    """
+    messages to extract all parameters of a tool, including python code, in a single structured output call
+    """
+    schema = toParameterSchema(schema)
+    codeInstruction = f"""
+
+For the value of "code", generate python code according to the following instruction:
+<instruction>
+{schema["properties"]["code"]["description"]} Remember, you should format the requested information, if any, into a string that is easily readable by humans. Use the 'print' function in the final line to display the requested information.
+</instruction>""" if "code" in schema["properties"] else ""
+    return ongoingMessages[:-2] + [
+        {
+            "role": "system",
+            "content": "You are a JSON builder expert that outputs in JSON.",
+        },
+        {
+            "role": "user",
+            "content": f"""Response in JSON, according to the following schema, based on my request below.
+
+<schema>
+{json.dumps(schema["properties"], ensure_ascii=False)}
+</schema>
+
+<request>
+{userInput}
+</request>
+
+Generate content to fill up the value of each required key in the JSON, if information is not provided.{codeInstruction}
+
+Remember, output in JSON.""",
+        },
+    ]
+
 def toChatml(messages: dict=[], use_system_message=True) -> str:
     messages_str = ""
     roles = {
@@ -712,7 +918,8 @@ def toGeminiMessages(messages: dict=[]) -> Optional[list]:
                 if role == "user":
                     lastUserMessage = content
             elif role == "system":
-                systemMessage = content
+                # volatile context may follow the main system message
+                systemMessage = f"{systemMessage}\n\n{content}" if systemMessage else content
         if history and history[-1].role == "user":
             history = history[:-1]
         else:
@@ -821,31 +1028,67 @@ def confirmExecution(risk):
 
 # embedding
 
+# embedding functions and collection handles shared by the whole process
+# cleared by clearEmbeddingCache when config.embeddingModel is changed
+embeddingFunctions = {}
+collectionHandles = {}
+
 def getEmbeddingFunction(embeddingModel=None):
     # import statement is placed here to make this file compatible on Android
     embeddingModel = embeddingModel if embeddingModel is not None else config.embeddingModel
-    if embeddingModel in ("text-embedding-3-large", "text-embedding-3-small", "text-embedding-ada-002"):
-        return embedding_functions.OpenAIEmbeddingFunction(api_key=config.openaiApiKey, model_name=embeddingModel)
-    return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=embeddingModel) # support custom Sentence Transformer Embedding models by modifying config.embeddingModel
+    isOpenAIModel = embeddingModel in ("text-embedding-3-large", "text-embedding-3-small", "text-embedding-ada-002")
+    key = (embeddingModel, config.openaiApiKey if isOpenAIModel else config.embeddingDevice)
+    if not key in embeddingFunctions:
+        if isOpenAIModel:
+            embeddingFunctions[key] = embedding_functions.OpenAIEmbeddingFunction(api_key=config.openaiApiKey, model_name=embeddingModel)
+        else:
+            embeddingFunctions[key] = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=embeddingModel, device=config.embeddingDevice) # support custom Sentence Transformer Embedding models by modifying config.embeddingModel
+    return embeddingFunctions[key]
+
+def clearEmbeddingCache():
+    embeddingFunctions.clear()
+    collectionHandles.clear()
+    intentCentroids.clear()
 
 # chromadb
 
 def get_or_create_collection(client, collection_name):
+    key = (id(client), collection_name)
+    cached = collectionHandles.get(key)
+    # check identity in case id of a discarded client is reused
+    if cached is not None and cached[0] is client:
+        return cached[1]
     collection = client.get_or_create_collection(
         name=collection_name,
         metadata={"hnsw:space": "cosine"},
         embedding_function=getEmbeddingFunction(),
     )
+    collectionHandles[key] = (client, collection)
     return collection
 
-def add_vector(collection, text, metadata):
-    id = str(uuid.uuid4())
+def delete_collection(client, collection_name):
+    collectionHandles.pop((id(client), collection_name), None)
+    client.delete_collection(collection_name)
+
+def add_vector(collection, text, metadata, id=None):
+    if id is None:
+        id = str(uuid.uuid4())
     collection.add(
         documents = [text],
         metadatas = [metadata],
         ids = [id]
     )
 
+def add_vectors(collection, texts, metadatas, ids=None):
+    # embed multiple documents in a single call
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in texts]
+    collection.add(
+        documents = texts,
+        metadatas = metadatas,
+        ids = ids
+    )
+
 def query_vectors(collection, query, n=1):
     return collection.query(
         query_texts=[query],
@@ -1043,19 +1286,85 @@ def getDayOfWeek():
 
 # device information
 
-def getDeviceInfo(includeIp=False):
+# static fields are read once; geolocation and ip addresses are kept for config.device_info_ttl seconds and refreshed in background, so that a chat turn never waits for network lookups
+deviceInfoCache = {}
+deviceInfoLock = threading.Lock()
+
+def getStaticDeviceInfo() -> str:
+    if not "static" in deviceInfoCache:
+        if hasattr(config, "thisPlatform"):
+            thisPlatform = config.thisPlatform
+        else:
+            thisPlatform = platform.system()
+            if thisPlatform == "Darwin":
+                thisPlatform = "macOS"
+        deviceInfoCache["static"] = f"""Operating system: {thisPlatform}
+Version: {platform.version()}
+Machine: {platform.machine()}
+Architecture: {platform.architecture()[0]}
+Processor: {platform.processor()}
+Hostname: {socket.gethostname()}
+Username: {getpass.getuser()}
+Python version: {platform.python_version()}
+Python implementation: {platform.python_implementation()}"""
+    return deviceInfoCache["static"]
+
+def lookupDeviceLocation() -> dict:
     g = geocoder.ip('me')
-    if hasattr(config, "thisPlatform"):
-        thisPlatform = config.thisPlatform
-    else:
-        thisPlatform = platform.system()
-        if thisPlatform == "Darwin":
-            thisPlatform = "macOS"
+    # geocoder reports failures in the result rather than raising
+    if not g.ok:
+        return None
+    return {"latlng": g.latlng, "country": g.country, "state": g.state, "city": g.city}
+
+def lookupDeviceIp() -> dict:
+    return {"wan_ip": get_wan_ip(), "local_ip": get_local_ip()}
+
+def refreshDeviceInfo(field: str, lookup) -> None:
+    try:
+        value = lookup()
+    except:
+        value = None
+    with deviceInfoLock:
+        if value is None:
+            # keep any earlier value, and do not look up again before config.device_info_retry_delay seconds
+            deviceInfoCache[f"{field}_retry"] = time.time() + config.device_info_retry_delay
+        else:
+            deviceInfoCache[field] = (time.time(), value)
+            deviceInfoCache.pop(f"{field}_retry", None)
+        deviceInfoCache.pop(f"{field}_refreshing", None)
+
+def getCachedDeviceInfo(field: str, lookup) -> Optional[dict]:
+    """
+    return cached value of a network dependent field, which is None before the first lookup completes
+    a background refresh is started when the value is missing or older than config.device_info_ttl, unless a failed lookup is waiting to be retried
+    """
+    with deviceInfoLock:
+        timestamp, value = deviceInfoCache.get(field, (0, None))
+        now = time.time()
+        if now - timestamp > config.device_info_ttl and now >= deviceInfoCache.get(f"{field}_retry", 0) and not deviceInfoCache.get(f"{field}_refreshing", False):
+            deviceInfoCache[f"{field}_refreshing"] = True
+            threading.Thread(target=refreshDeviceInfo, args=(field, lookup), daemon=True).start()
+    return value
+
+def getDeviceLocation() -> Optional[dict]:
+    return getCachedDeviceInfo("location", lookupDeviceLocation)
+
+def preloadDeviceInfo() -> None:
+    getStaticDeviceInfo()
+    getDeviceLocation()
+    if config.includeIpInDeviceInfo:
+        getCachedDeviceInfo("ip", lookupDeviceIp)
+
+def getDeviceInfo(includeIp=False):
+    location = getDeviceLocation()
+    if location is None:
+        location = {"latlng": None, "country": None, "state": None, "city": None}
     if config.includeIpInDeviceInfoTemp or includeIp or (config.includeIpInDeviceInfo and config.includeIpInDeviceInfoTemp):
-        wan_ip = get_wan_ip()
-        local_ip = get_local_ip()
-        ipInfo = f'''Wan ip: {wan_ip}
-Local ip: {local_ip}
+        ip = getCachedDeviceInfo("ip", lookupDeviceIp)
+        if ip is None:
+            ip = {"wan_ip": "", "local_ip": get_local_ip()}
+        ipInfo = f'''Wan ip: {ip["wan_ip"]}
+Local ip: {ip["local_ip"]}
 '''
     else:
         ipInfo = ""
@@ -1064,22 +1373,14 @@ Local ip: {local_ip}
     else:
         dayOfWeek = getDayOfWeek()
         dayOfWeek = f"Current day of the week: {dayOfWeek}"
-    return f"""Operating system: {thisPlatform}
-Version: {platform.version()}
-Machine: {platform.machine()}
-Architecture: {platform.architecture()[0]}
-Processor: {platform.processor()}
-Hostname: {socket.gethostname()}
-Username: {getpass.getuser()}
-Python version: {platform.python_version()}
-Python implementation: {platform.python_implementation()}
+    return f"""{getStaticDeviceInfo()}
 Current directory: {os.getcwd()}
 Current time: {str(datetime.datetime.now())}
 {dayOfWeek}
-{ipInfo}Latitude & longitude: {g.latlng}
-Country: {g.country}
-State: {g.state}
-City: {g.city}"""
+{ipInfo}Latitude & longitude: {location["latlng"]}
+Country: {location["country"]}
+State: {location["state"]}
+City: {location["city"]}"""
 
 # token management
 
@@ -1111,15 +1412,172 @@ def getDynamicTokens(messages, functionSignatures=None):
         return availableTokens
     return config.chatGPTApiMinTokens
 
+# token budgeting for non-OpenAI backends
+# context limits are read from the loaded gguf model, ollama model information and known groq and gemini limits
+
+groqTokenLimits = {
+    "llama3-8b-8192": 8192,
+    "llama3-70b-8192": 8192,
+    "mixtral-8x7b-32768": 32768,
+    "gemma-7b-it": 8192,
+}
+
+# reference: https://ai.google.dev/gemini-api/docs/models/gemini
+geminiTokenLimits = {
+    "gemini-pro": 32760, # 30720 input and 2048 output tokens
+}
+
+ollamaContextLengths = {}
+
+def getOllamaContextLength(model: str, server: str="main") -> int:
+    if not model in ollamaContextLengths:
+        try:
+            info = getOllamaServerClient(server).show(model)
+            info = info.get("model_info", info.get("modelinfo", {}))
+            contextLength = next((value for key, value in info.items() if key.endswith(".context_length")), 0)
+        except:
+            # not cached, so that a model pulled, or a server started, later is looked up again
+            return 0
+        if not contextLength:
+            return 0
+        ollamaContextLengths[model] = contextLength
+    return ollamaContextLengths[model]
+
+def getContextLimit(backend: str="", model: str="", server: str="main") -> int:
+    """
+    context window, in tokens, of a backend model; 0 if unknown
+    """
+    if not backend:
+        backend = config.llmInterface
+    if backend == "llamacpp":
+        if getattr(config, "llamacppMainModel", None) is None:
+            return 0
+        # in "auto" context mode, the context window grows up to the training context
+        return config.llamacppMainModel.n_ctx_train() if config.llamacppMainModel_n_ctx == "auto" else config.llamacppMainModel.n_ctx()
+    elif backend == "ollama":
+        if not model:
+            model = config.ollamaMainModel
+        num_ctx = config.ollamaChatModel_num_ctx if model == config.ollamaChatModel and not model == config.ollamaMainModel else config.ollamaMainModel_num_ctx
+        return getOllamaContextLength(model, server) if num_ctx == "auto" else num_ctx
+    elif backend == "groq":
+        return groqTokenLimits.get(model if model else config.groqApi_main_model, 0)
+    elif backend == "llamacppserver":
+        return config.llamacppMainModel_n_ctx if isinstance(config.llamacppMainModel_n_ctx, int) else 0
+    elif backend == "gemini":
+        return geminiTokenLimits.get(model if model else "gemini-pro", 0)
+    elif backend in ("chatgpt", "letmedoit"):
+        return tokenLimits.get(model if model else config.chatGPTApiModel, 0)
+    return 0
+
+class GGUFEncoding:
+    """
+    tokenizer of the loaded llama.cpp main model, with the interface of a tiktoken encoding used by the token ledger
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.name = f"gguf:{llm.model_path}"
+
+    def encode(self, text: str) -> list:
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+
+def countContextTokens(messages: list, backend: str="") -> int:
+    if not backend:
+        backend = config.llmInterface
+    if backend == "llamacpp" and getattr(config, "llamacppMainModel", None) is not None:
+        encoding = GGUFEncoding(config.llamacppMainModel)
+        # chatml wraps each message with <|im_start|>, <|im_end|> and new lines; a reply is primed with <|im_start|>assistant
+        return sum(4 + countMessageTokens(message, encoding, 0) for message in messages) + 3
+    # tiktoken only approximates tokenizers of other models
+    return int(count_tokens_from_messages(messages) * 1.1)
+
+def getMaxOutputTokens(messages: list, max_tokens: Optional[int]=None, backend: str="", model: str="", server: str="main") -> Optional[int]:
+    """
+    max_tokens capped at the space left in the context window; unlimited max_tokens, i.e. None or negative, are not changed
+    None if messages already fill the context window, so that a request is not sent
+    """
+    limit = getContextLimit(backend, model, server)
+    if not limit:
+        return max_tokens
+    used = countContextTokens(messages, backend)
+    available = limit - used
+    if available < config.minimum_output_tokens:
+        print2(f"""Context window is full! {used} of {limit} tokens are used. Press '{str(config.hotkey_new).replace("'", "")[1:-1]}' to start a new chat!""")
+        return None
+    if max_tokens is None or max_tokens < 0:
+        return max_tokens
+    return min(max_tokens, available)
+
+# adaptive context window
+
+# context window sizes in use, by model; see getContextWindowSize
+contextWindowSizes = {}
+
+def getContextWindowSize(model: str, messages: list, outputTokens: int=-1, maximum: int=0) -> int:
+    """
+    smallest size in config.context_window_buckets that fits messages and output tokens
+    the size never decreases for a model, so that a model is reloaded only when a larger bucket is needed
+    """
+    if outputTokens is None or outputTokens < 0:
+        outputTokens = config.context_window_output_tokens
+    # allow a margin, as tiktoken only approximates tokenizers of local models
+    required = int(count_tokens_from_messages(messages) * 1.1) + outputTokens if messages else outputTokens
+    buckets = sorted(config.context_window_buckets)
+    size = max(next((i for i in buckets if i >= required), buckets[-1]), contextWindowSizes.get(model, 0))
+    if maximum:
+        size = min(size, maximum)
+    contextWindowSizes[model] = size
+    return size
+
+# token ledger
+# encoders, token counts of individual messages and tool schemas are cached, so that only new or edited content is tokenized
+
+@functools.lru_cache(maxsize=None)
+def getTokenEncoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        print("Warning: model not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+messageTokenCounts = {}
+toolSchemaTokenCount = {"schemas": None, "size": 0, "model": "", "count": 0}
+
+def countMessageTokens(message: dict, encoding, tokens_per_name: int) -> int:
+    if not "content" in message or not message.get("content", ""):
+        return len(encoding.encode(str(message)))
+    items = tuple(message.items())
+    # str hashes are cached by python, so looking up an unchanged message does not scan its content again
+    key = (encoding.name, tokens_per_name, items) if all(isinstance(value, str) for _, value in items) else None
+    if key is not None and key in messageTokenCounts:
+        return messageTokenCounts[key]
+    num_tokens = 0
+    for key_, value in items:
+        num_tokens += len(encoding.encode(value))
+        if key_ == "name":
+            num_tokens += tokens_per_name
+    if key is not None:
+        if len(messageTokenCounts) > 10000:
+            messageTokenCounts.clear()
+        messageTokenCounts[key] = num_tokens
+    return num_tokens
+
+def countToolSchemaTokens(model="") -> int:
+    """
+    token count of all tool schemas; counted again only when tools are added or removed
+    """
+    if not model:
+        model = config.chatGPTApiModel
+    schemas = config.toolFunctionSchemas
+    if not (toolSchemaTokenCount["schemas"] is schemas and toolSchemaTokenCount["size"] == len(schemas) and toolSchemaTokenCount["model"] == model):
+        toolSchemaTokenCount.update({"schemas": schemas, "size": len(schemas), "model": model, "count": count_tokens_from_functions(schemas.values(), model)})
+    return toolSchemaTokenCount["count"]
+
 def count_tokens_from_functions(functionSignatures, model=""):
     count = 0
     if not model:
         model = config.chatGPTApiModel
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = getTokenEncoding(model)
     for i in functionSignatures:
         count += len(encoding.encode(str(i)))
     return count
@@ -1131,11 +1589,7 @@ def count_tokens_from_messages(messages, model=""):
         model = config.chatGPTApiModel
 
     """Return the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = getTokenEncoding(model)
     if model in {
             "gpt-4o",
             "gpt-3.5-turbo",
@@ -1173,13 +1627,7 @@ def count_tokens_from_messages(messages, model=""):
     num_tokens = 0
     for message in messages:
         num_tokens += tokens_per_message
-        if not "content" in message or not message.get("content", ""):
-            num_tokens += len(encoding.encode(str(message)))
-        else:
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":
-                    num_tokens += tokens_per_name
+        num_tokens += countMessageTokens(message, encoding, tokens_per_name)
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
@@ -1233,7 +1681,8 @@ def getWeather(latlng=""):
 
     # latitude, longitude
     if not latlng:
-        latlng = geocoder.ip('me').latlng
+        location = getDeviceLocation()
+        latlng = location["latlng"] if location is not None and location["latlng"] else geocoder.ip('me').latlng
 
     try:
         latitude, longitude = latlng
@@ -1281,6 +1730,8 @@ def getPackageLatestVersion(package):
 
 def restartApp():
     print(f"Restarting {config.freeGeniusAIName} ...")
+    # write pending config changes before the new instance loads them
+    config.flushConfig()
     os.system(f"{sys.executable} {config.freeGeniusAIFile}")
     exit(0)
 
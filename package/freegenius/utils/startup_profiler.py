@@ -0,0 +1,70 @@
+from freegenius import config, print2, print3
+from contextlib import contextmanager
+import os, sys, json, time, datetime, psutil
+
+# wall time and memory usage of startup phases, recorded when the app is started with --profile-startup
+# the report is written to startup_profile.json in local storage when the first prompt is ready
+# phases may be nested, e.g. plugins run within "Plugins.runPlugins"; a nested phase records its parent and depth, and its time is included in that of its parent
+startupProfile = {"enabled": "--profile-startup" in sys.argv, "phases": [], "plugins": [], "stack": []}
+
+@contextmanager
+def profileStartupPhase(name: str, plugin: bool=False):
+    if not startupProfile["enabled"]:
+        yield
+        return
+    stack = startupProfile["stack"]
+    entry = {
+        "name": name,
+        "parent": stack[-1]["name"] if stack else None,
+        "depth": len(stack),
+    }
+    # phases are listed in the order they start, so that nested phases follow their parents
+    startupProfile["plugins" if plugin else "phases"].append(entry)
+    stack.append(entry)
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stack.pop()
+        entry["seconds"] = round(time.perf_counter() - start, 4)
+        entry["rss_delta_mb"] = round((process.memory_info().rss - rss) / 1048576, 2)
+
+def getStartupProfileFile() -> str:
+    return os.path.join(config.localStorage, "startup_profile.json")
+
+def isStartupRegression(report: dict, threshold: float) -> bool:
+    return bool(threshold) and report["time_to_prompt"] > threshold
+
+def finishStartupProfile():
+    if not startupProfile["enabled"]:
+        return None
+    # record startup only once, not plugins reloaded later, e.g. on model changes
+    startupProfile["enabled"] = False
+    process = psutil.Process()
+    report = {
+        "timestamp": str(datetime.datetime.now()),
+        "llmInterface": config.llmInterface,
+        # since process creation, including imports
+        "time_to_prompt": round(time.time() - process.create_time(), 4),
+        "rss_mb": round(process.memory_info().rss / 1048576, 2),
+        "phases": startupProfile["phases"],
+        "plugins": sorted(startupProfile["plugins"], key=lambda i: i["seconds"], reverse=True),
+    }
+    with open(getStartupProfileFile(), "w", encoding="utf-8") as fileObj:
+        json.dump(report, fileObj, indent=4)
+
+    print2("```startup")
+    # nested phases are indented under their parents; only unindented rows add up to startup time
+    for i in report["phases"]:
+        print(f"{i['seconds']:>8.3f}s {i['rss_delta_mb']:>+9.1f} MB  {'  ' * i['depth']}{i['name']}")
+    for i in report["plugins"][:10]:
+        parent = f" (in {i['parent']})" if i["parent"] else ""
+        print(f"{i['seconds']:>8.3f}s {i['rss_delta_mb']:>+9.1f} MB  plugin: {i['name']}{parent}")
+    print3(f"Time to prompt: {report['time_to_prompt']:.2f}s; memory: {report['rss_mb']:.1f} MB")
+    print3(f"Report: {getStartupProfileFile()}")
+    if isStartupRegression(report, config.startup_time_threshold):
+        print2(f"Startup is slower than threshold: {config.startup_time_threshold}s!")
+    print2("```")
+    return report
@@ -6,7 +6,7 @@ from freegenius.utils.tts_utils import TTSUtil
 #from prompt_toolkit import print_formatted_text
 from prompt_toolkit.keys import Keys
 from prompt_toolkit.input import create_input
-import asyncio, shutil, textwrap, re
+import asyncio, shutil, textwrap, re, threading, time
 
 
 class StreamingWordWrapper:
@@ -14,12 +14,30 @@ class StreamingWordWrapper:
     def __init__(self):
         self.streaming_finished = False
         config.tempChunk = ""
+        # wrapped output is buffered and written to the terminal at most every config.streaming_refresh_interval seconds, or on a new line
+        self.buffer = []
+        self.bufferLock = threading.Lock()
+        self.lastFlush = 0.0
+
+    def write(self, text):
+        with self.bufferLock:
+            self.buffer.append(text)
+            if not "\n" in text and time.perf_counter() - self.lastFlush < config.streaming_refresh_interval:
+                return None
+        self.flush()
+
+    def flush(self):
+        with self.bufferLock:
+            self.lastFlush = time.perf_counter()
+            if self.buffer:
+                print("".join(self.buffer), end="", flush=True)
+                self.buffer = []
 
     def wrapStreamWords(self, answer, terminal_width):
         if " " in answer:
             if answer == " ":
                 if self.lineWidth < terminal_width:
-                    print(" ", end='', flush=True)
+                    self.write(" ")
                     self.lineWidth += 1
             else:
                 answers = answer.split(" ")
@@ -29,29 +47,29 @@ class StreamingWordWrapper:
                     newLineWidth = (self.lineWidth + itemWidth) if isLastItem else (self.lineWidth + itemWidth + 1)
                     if isLastItem:
                         if newLineWidth > terminal_width:
-                            print(f"\n{item}", end='', flush=True)
+                            self.write(f"\n{item}")
                             self.lineWidth = itemWidth
                         else:
-                            print(item, end='', flush=True)
+                            self.write(item)
                             self.lineWidth += itemWidth
                     else:
                         if (newLineWidth - terminal_width) == 1:
-                            print(f"{item}\n", end='', flush=True)
+                            self.write(f"{item}\n")
                             self.lineWidth = 0
                         elif newLineWidth > terminal_width:
-                            print(f"\n{item} ", end='', flush=True)
+                            self.write(f"\n{item} ")
                             self.lineWidth = itemWidth + 1
                         else:
-                            print(f"{item} ", end='', flush=True)
+                            self.write(f"{item} ")
                             self.lineWidth += (itemWidth + 1)
         else:
             answerWidth = getStringWidth(answer)
             newLineWidth = self.lineWidth + answerWidth
             if newLineWidth > terminal_width:
-                print(f"\n{answer}", end='', flush=True)
+                self.write(f"\n{answer}")
                 self.lineWidth = answerWidth
             else:
-                print(answer, end='', flush=True)
+                self.write(answer)
                 self.lineWidth += answerWidth
 
     def keyToStopStreaming(self, streaming_event):
@@ -64,6 +82,7 @@ class StreamingWordWrapper:
                 for key_press in input.read_keys():
                     #print(key_press)
                     if key_press.key in (Keys.ControlQ, Keys.ControlZ):
+                        self.flush()
                         print("\n")
                         done = True
                         streaming_event.set()
@@ -73,6 +92,8 @@ class StreamingWordWrapper:
                     while not done:
                         if self.streaming_finished:
                             break
+                        # show output buffered before a pause in streaming
+                        self.flush()
                         await asyncio.sleep(0.1)
 
         asyncio.run(readKeys())
@@ -85,6 +106,7 @@ class StreamingWordWrapper:
             config.wrapWords = wrapWords
             # reset config.tempChunk
             config.tempChunk = ""
+            self.flush()
             print("" if config.llmInterface == "llamacpp" else "\n")
             # add chat response to messages
             if chat_response:
@@ -149,12 +171,12 @@ class StreamingWordWrapper:
                                 isLastLine = (len(lines) - index == 1)
                                 self.wrapStreamWords(line, terminal_width)
                                 if not isLastLine:
-                                    print("\n", end='', flush=True)
+                                    self.write("\n")
                                     self.lineWidth = 0
                         else:
                             self.wrapStreamWords(answer, terminal_width)
                     else:
-                        print(answer, end='', flush=True) # Print the response
+                        self.write(answer) # Print the response
                     # speak streaming words
                     self.readAnswer(answer)
             else:
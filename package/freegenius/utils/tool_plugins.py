@@ -1,10 +1,13 @@
-from freegenius import config, get_or_create_collection, add_vector, getFilenamesWithoutExtension, execPythonFile
+from freegenius import config, get_or_create_collection, delete_collection, add_vectors, getFilenamesWithoutExtension, execPythonFile
 from freegenius import print2
+from freegenius.utils.startup_profiler import profileStartupPhase
 from pathlib import Path
 from chromadb.config import Settings
-import os, shutil, chromadb, json
+import os, shutil, chromadb, json, hashlib, threading
 from typing import Callable
 
+# plugins with a manifest are executed on the first call of their tools
+pluginLoadLock = threading.Lock()
 
 class Plugins:
 
@@ -21,8 +24,16 @@ class Plugins:
         config.inputSuggestions = []
         config.outputTransformers = []
         config.deviceInfoPlugins = []
+        # tools declared safe to run concurrently with other tools; all other tools run serially, as they may ask for confirmation or pass content via config.tempContent
+        config.concurrentTools = []
         config.toolFunctionSchemas = {}
         config.toolFunctionMethods = {}
+        # tools declared in plugin manifests, mapped to plugin scripts that are not executed yet
+        config.lazyTools = {}
+        # tool store records registered in this run; see ToolStore.flushTools
+        config.toolStoreIds = {}
+        config.toolStorePending = {}
+        config.toolStoreReport = {"reused": 0, "embedded": 0, "removed": 0}
 
         pluginFolder = os.path.join(config.freeGeniusAIFolder, "plugins")
         if config.localStorage:
@@ -49,20 +60,59 @@ class Plugins:
             for plugin in getFilenamesWithoutExtension(folder, "py"):
                 if not plugin in config.pluginExcludeList:
                     script = os.path.join(folder, "{0}.py".format(plugin))
-                    run = execPythonFile(script)
+                    manifest = os.path.join(folder, "{0}.json".format(plugin))
+                    with profileStartupPhase(plugin, plugin=True):
+                        run = Plugins.loadManifest(manifest, script) if os.path.isfile(manifest) else execPythonFile(script)
                     if not run:
                         config.pluginExcludeList.append(plugin)
         if internetSeraches in config.pluginExcludeList:
             del config.toolFunctionSchemas["integrate_google_searches"]
+        if hasattr(config, "tool_store_client"):
+            with profileStartupPhase("ToolStore.flushTools"):
+                ToolStore.flushTools()
         for i in config.toolFunctionMethods:
             if not i in ("python_qa",):
                 callEntry = f"[TOOL_{i}]"
                 if not callEntry in config.inputSuggestions:
                     config.inputSuggestions.append(callEntry)
 
+    @staticmethod
+    def loadManifest(manifest: str, script: str) -> bool:
+        """
+        register tools declared in a plugin manifest, without executing the plugin
+        a manifest is a json file named after the plugin, e.g.:
+        {"tools": [{"signature": {"name": ..., "description": ..., "examples": [...], "parameters": {...}}, "deviceInfo": false, "concurrent": false}]}
+        plugins that do more than adding tools, e.g. adding contexts or aliases, should not have a manifest
+        """
+        try:
+            with open(manifest, "r", encoding="utf-8") as fileObj:
+                tools = json.load(fileObj)["tools"]
+            for tool in tools:
+                name = tool["signature"]["name"]
+                Plugins.addFunctionCall(signature=tool["signature"], method=Plugins.getLazyMethod(name, script), deviceInfo=tool.get("deviceInfo", False), concurrent=tool.get("concurrent", False))
+                if name in config.toolFunctionMethods:
+                    config.lazyTools[name] = script
+            return True
+        except:
+            print2(f"Failed to read manifest '{os.path.basename(manifest)}'!")
+            return execPythonFile(script)
+
+    @staticmethod
+    def getLazyMethod(name: str, script: str) -> Callable[[dict], str]:
+        def method(function_args: dict) -> str:
+            with pluginLoadLock:
+                if name in config.lazyTools:
+                    # the plugin replaces this method with the actual one; see Plugins.addFunctionCall
+                    if not execPythonFile(script) or name in config.lazyTools:
+                        config.lazyTools.pop(name, None)
+                        config.toolFunctionMethods[name] = lambda _: "[INVALID]"
+                        print2(f"Tool '{name}' is not added by '{os.path.basename(script)}'!")
+            return config.toolFunctionMethods[name](function_args)
+        return method
+
     # integrate function call plugin
     @staticmethod
-    def addFunctionCall(signature: str, method: Callable[[dict], str], deviceInfo=False):
+    def addFunctionCall(signature: str, method: Callable[[dict], str], deviceInfo=False, concurrent=False):
         if hasattr(config, "currentMessages"):
             name = signature["name"]
             if not name in config.toolFunctionSchemas: # prevent duplicaiton
@@ -71,33 +121,87 @@ class Plugins:
                 ToolStore.add_tool(signature)
                 if deviceInfo:
                     config.deviceInfoPlugins.append(name)
+                # only tools that neither ask for user input nor pass content via config.tempContent should be declared concurrent
+                if concurrent:
+                    config.concurrentTools.append(name)
+            elif name in config.lazyTools:
+                # plugin with a manifest is executed on first call; replace the method registered from its manifest
+                config.toolFunctionMethods[name] = method
+                del config.lazyTools[name]
 
 class ToolStore:
 
     @staticmethod
     def setupToolStoreClient():
         tool_store = os.path.join(config.localStorage, "tool_store")
+        Path(tool_store).mkdir(parents=True, exist_ok=True)
         try:
+            config.tool_store_client = chromadb.PersistentClient(tool_store, Settings(anonymized_telemetry=False))
+            # stored tools are reusable only if they were embedded with the current embedding model
+            collection = get_or_create_collection(config.tool_store_client, "tools")
+            metadatas = collection.get(include=["metadatas"])["metadatas"]
+            if any(i.get("embedding_model", "") != config.embeddingModel for i in metadatas):
+                delete_collection(config.tool_store_client, "tools")
+                print2("Tool store reset for a new embedding model!")
+        except:
+            # rebuild a broken tool store
             shutil.rmtree(tool_store, ignore_errors=True)
             print2("Old tool store removed!")
-        except:
-            print2("Failed to remove old tool store!")
-        Path(tool_store).mkdir(parents=True, exist_ok=True)
-        config.tool_store_client = chromadb.PersistentClient(tool_store, Settings(anonymized_telemetry=False))
+            Path(tool_store).mkdir(parents=True, exist_ok=True)
+            config.tool_store_client = chromadb.PersistentClient(tool_store, Settings(anonymized_telemetry=False))
+
+    @staticmethod
+    def getToolId(signature) -> str:
+        """
+        content hash of a tool signature, together with the embedding model that embeds it
+        """
+        content = {key: signature.get(key, None) for key in ("name", "description", "examples", "parameters")}
+        content["embedding_model"] = config.embeddingModel
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
 
     @staticmethod
     def add_tool(signature):
+        """
+        register a tool; embedding is deferred until ToolStore.flushTools is called
+        """
         name, description, parameters = signature["name"], signature["description"], signature["parameters"]
-        print(f"Adding tool: {name}")
         if "examples" in signature:
             #description = description + "\n" + "\n".join(signature["examples"])
             description = "\n".join(signature["examples"])
-        collection = get_or_create_collection(config.tool_store_client, "tools")
-        metadata = {
+        tool_id = ToolStore.getToolId(signature)
+        config.toolStoreIds[name] = tool_id
+        config.toolStorePending[tool_id] = (description, {
             "name": name,
             "parameters": json.dumps(parameters),
-        }
-        add_vector(collection, description, metadata)
+            "embedding_model": config.embeddingModel,
+        })
         # add input suggestions
         if "examples" in signature:
-            config.inputSuggestions += signature["examples"]
\ No newline at end of file
+            config.inputSuggestions += signature["examples"]
+
+    @staticmethod
+    def flushTools():
+        """
+        embed all new or changed tools registered while plugins run, in batches of config.tool_store_embedding_batch_size,
+        and delete stored tools that are changed, removed or disabled since they were embedded
+        """
+        collection = get_or_create_collection(config.tool_store_client, "tools")
+        activeIds = {tool_id for name, tool_id in config.toolStoreIds.items() if name in config.toolFunctionSchemas}
+        storedIds = set(collection.get(include=[])["ids"])
+        # embed new or changed tools
+        pendingIds = [i for i in config.toolStorePending if i in activeIds and not i in storedIds]
+        config.toolStoreReport["reused"] = len(activeIds & storedIds)
+        batchSize = config.tool_store_embedding_batch_size if config.tool_store_embedding_batch_size > 0 else max(len(pendingIds), 1)
+        for index in range(0, len(pendingIds), batchSize):
+            batchIds = pendingIds[index:index + batchSize]
+            for i in batchIds:
+                print(f"Adding tool: {config.toolStorePending[i][1]['name']}")
+            add_vectors(collection, [config.toolStorePending[i][0] for i in batchIds], [config.toolStorePending[i][1] for i in batchIds], batchIds)
+        config.toolStoreReport["embedded"] = len(pendingIds)
+        config.toolStorePending = {}
+        # remove inactive tools
+        inactiveIds = [i for i in storedIds if not i in activeIds]
+        if inactiveIds:
+            collection.delete(ids=inactiveIds)
+        config.toolStoreReport["removed"] = len(inactiveIds)
+        print2("Tool store: {reused} reused, {embedded} re-embedded, {removed} removed".format(**config.toolStoreReport))
@@ -1,9 +1,7 @@
-from freegenius import config, getHideOutputSuffix
+from freegenius import config, getHideOutputSuffix, LazyImport
 import os, traceback, subprocess, re, sounddevice, soundfile, pydoc, shutil
 from pathlib import Path
 from gtts import gTTS
-from elevenlabs.client import ElevenLabs
-from elevenlabs import play
 from freegenius.utils.vlc_utils import VlcUtil
 try:
     from google.cloud import texttospeech
@@ -20,6 +18,10 @@ except:
     config.usePygame = False
     config.isPygameInstalled = True
 
+# elevenlabs is imported only when its voices are used
+ElevenLabs = LazyImport("elevenlabs.client", "ElevenLabs")
+play = LazyImport("elevenlabs", "play")
+
 class TTSUtil:
 
     @staticmethod
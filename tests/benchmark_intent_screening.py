@@ -0,0 +1,33 @@
+from freegenius import config, isToolRequired, getZeroShotClassifier, getIntentCentroids
+import os, json, time
+
+# compare accuracy and latency of intent screening modes on a labelled prompt set
+# each prompt is labelled with whether a tool is required to resolve it
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_screening_prompts.json"), "r", encoding="utf-8") as fileObj:
+    labelled_prompts = json.load(fileObj)
+
+def benchmark(mode):
+    config.intent_screening_mode = mode
+    # load models before measuring
+    getZeroShotClassifier() if mode == "classifier" else getIntentCentroids()
+    correct = 0
+    latencies = []
+    for item in labelled_prompts:
+        start = time.perf_counter()
+        tool = isToolRequired(item["prompt"], display=False)
+        latencies.append(time.perf_counter() - start)
+        if tool == item["tool"]:
+            correct += 1
+        else:
+            print(f"[{mode}] expected {'tool' if item['tool'] else 'chat-only'}: {item['prompt']}")
+    latencies.sort()
+    return correct / len(labelled_prompts), sum(latencies) / len(latencies) * 1000, latencies[len(latencies) // 2] * 1000
+
+results = {mode: benchmark(mode) for mode in ("classifier", "embedding")}
+
+print(f"Prompts: {len(labelled_prompts)}")
+print(f"Classifier: {config.zero_shot_classification_model}")
+print(f"Embedding model: {config.embeddingModel}")
+for mode, (accuracy, mean, median) in results.items():
+    print(f"{mode}: accuracy {accuracy:.1%}; mean {mean:.1f} ms; median {median:.1f} ms")
@@ -0,0 +1,65 @@
+from freegenius import config
+from freegenius.utils.call_llm import CallLLM
+from freegenius.utils.call_llamacpp import CallLlamaCpp
+from freegenius.utils.call_ollama import CallOllama
+from freegenius.utils.tool_plugins import Plugins
+from ollama import Client
+import sys, time
+
+# compare LLM calls and wall time per tool invocation, with and without single-pass parameter extraction
+# usage: python benchmark_parameter_extraction.py [llamacpp|ollama]
+
+config.llmInterface = sys.argv[1] if len(sys.argv) > 1 else "llamacpp"
+config.conversationStarted = False
+config.currentMessages = []
+CallLLM.checkCompletion()
+Plugins.runPlugins()
+
+requests = {
+    "execute_computing_task": "Find the five largest files in my home directory.",
+    "create_qrcode": "Create a QR code for https://github.com/eliranwong/freegenius",
+    "search_weather_info": "What is the weather like in London now?",
+}
+requests = {name: request for name, request in requests.items() if name in config.toolFunctionSchemas}
+
+# count calls to the model
+calls = []
+if config.llmInterface == "ollama":
+    extractToolParameters = CallOllama.extractToolParameters
+    chat = Client.chat
+    def countedChat(*args, **kwargs):
+        calls.append(1)
+        return chat(*args, **kwargs)
+    Client.chat = countedChat
+else:
+    extractToolParameters = CallLlamaCpp.extractToolParameters
+    createChatCompletion = CallLlamaCpp.createChatCompletion
+    def countedCreateChatCompletion(**kwargs):
+        calls.append(1)
+        return createChatCompletion(**kwargs)
+    CallLlamaCpp.createChatCompletion = countedCreateChatCompletion
+
+def benchmark(singlePass):
+    config.single_pass_parameter_extraction = singlePass
+    results = {}
+    for name, request in requests.items():
+        messages = [{"role": "user", "content": request}, {"role": "assistant", "content": "[CALLING]"}]
+        calls.clear()
+        start = time.perf_counter()
+        parameters = extractToolParameters(schema=config.toolFunctionSchemas[name], userInput=request, ongoingMessages=messages)
+        results[name] = (len(calls), time.perf_counter() - start, sorted(parameters))
+    return results
+
+before = benchmark(False)
+# the first single-pass call of each tool includes compiling its grammar
+benchmark(True)
+after = benchmark(True)
+
+print(f"LLM interface: {config.llmInterface}")
+for name in requests:
+    print(f"{name}:")
+    print(f"  two-pass: {before[name][0]} calls; {before[name][1]:.2f}s; parameters: {before[name][2]}")
+    print(f"  single-pass: {after[name][0]} calls; {after[name][1]:.2f}s; parameters: {after[name][2]}")
+totalBefore, totalAfter = sum(i[1] for i in before.values()), sum(i[1] for i in after.values())
+if totalAfter:
+    print(f"Speed-up: {totalBefore / totalAfter:.1f}x")
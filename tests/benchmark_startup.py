@@ -0,0 +1,27 @@
+from freegenius import config
+from freegenius.utils.startup_profiler import getStartupProfileFile, isStartupRegression
+import subprocess, sys, json
+
+# start the assistant with --profile-startup, up to the first prompt, and fail if time to prompt exceeds a threshold
+# usage: python benchmark_startup.py [threshold in seconds; default: config.startup_time_threshold]
+
+threshold = float(sys.argv[1]) if len(sys.argv) > 1 else config.startup_time_threshold
+
+subprocess.run([sys.executable, "-c", "from freegenius.utils.assistant import FreeGenius; FreeGenius()", "--profile-startup"], check=True)
+
+with open(getStartupProfileFile(), "r", encoding="utf-8") as fileObj:
+    report = json.load(fileObj)
+
+print(f"LLM interface: {report['llmInterface']}")
+print(f"Time to prompt: {report['time_to_prompt']:.2f}s")
+print(f"Memory: {report['rss_mb']:.1f} MB")
+# nested phases are indented under their parents
+for i in report["phases"]:
+    print(f"{'  ' * i.get('depth', 0)}{i['name']}: {i['seconds']:.3f}s; {i['rss_delta_mb']:+.1f} MB")
+if report["plugins"]:
+    slowest = report["plugins"][0]
+    print(f"Slowest plugin: {slowest['name']} ({slowest['seconds']:.3f}s)")
+
+if isStartupRegression(report, threshold):
+    print(f"Regression: time to prompt exceeds {threshold}s!")
+    sys.exit(1)
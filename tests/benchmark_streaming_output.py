@@ -0,0 +1,50 @@
+from freegenius import config
+from freegenius.utils.streaming_word_wrapper import StreamingWordWrapper
+import sys, json, time, threading, re
+
+# replay a token stream as fast as possible and compare terminal writes and wall time, with and without buffered output
+# usage: python benchmark_streaming_output.py [recorded stream, i.e. a json list of text chunks]
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1], "r", encoding="utf-8") as fileObj:
+        chunks = json.load(fileObj)
+else:
+    text = "Streaming output is written to the terminal as soon as each chunk arrives from a backend. " * 8
+    text = "\n\n".join([text] * 30)
+    # split into word fragments, similar to tokens streamed by backends
+    chunks = re.findall(r" ?[^ \n]{1,4}|\n", text)
+
+config.ttsOutput = False
+config.wrapWords = True
+
+class CountingOutput:
+    def __init__(self, output):
+        self.output = output
+        self.writes = 0
+    def write(self, text):
+        self.writes += 1
+        return self.output.write(text)
+    def flush(self):
+        return self.output.flush()
+
+def benchmark(interval):
+    config.streaming_refresh_interval = interval
+    # llama.cpp chat format
+    completion = ({"choices": [{"delta": {"content": chunk}}]} for chunk in chunks)
+    stdout = sys.stdout
+    sys.stdout = CountingOutput(stdout)
+    start = time.perf_counter()
+    try:
+        StreamingWordWrapper().streamOutputs(threading.Event(), completion)
+    finally:
+        writes = sys.stdout.writes
+        sys.stdout = stdout
+    return writes, time.perf_counter() - start
+
+before = benchmark(0)
+after = benchmark(0.016)
+
+print(f"Chunks: {len(chunks)}")
+print(f"Unbuffered: {before[0]} writes; {before[1]:.3f}s")
+print(f"Buffered (16 ms): {after[0]} writes; {after[1]:.3f}s")
+print(f"Speed-up: {before[1] / after[1]:.1f}x")
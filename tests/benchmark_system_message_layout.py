@@ -0,0 +1,49 @@
+from freegenius import config
+from freegenius.utils.call_llm import CallLLM
+from freegenius.utils.call_llamacpp import CallLlamaCpp
+import copy, time
+
+# compare time to first token on a long chat with the in-process llama.cpp backend:
+# - moving: system message rewritten and moved to the end of the conversation on every input
+# - cache-friendly: system message stays first and unchanged; volatile context is sent in a trailing system message
+
+history_turns = 20 # turns in the chat before measuring
+measured_turns = 5
+
+config.llmInterface = "llamacpp"
+config.conversationStarted = False
+CallLlamaCpp.checkCompletion()
+
+history = []
+for i in range(history_turns):
+    history.append({"role": "user", "content": f"Tell me an interesting fact about the number {i}."})
+    history.append({"role": "assistant", "content": f"The number {i} appears in many places in mathematics, science and culture; for example, it is used in counting, measurement, calendars and games played all over the world."})
+
+def benchmark(cacheFriendly):
+    config.cache_friendly_system_message = cacheFriendly
+    config.conversationStarted = True
+    messages = CallLLM.resetMessages() + copy.deepcopy(history)
+    latencies = []
+    for i in range(measured_turns + 1):
+        messages = CallLLM.updateSystemMessage(messages)
+        messages.append({"role": "user", "content": f"And what about {history_turns + i}?"})
+        start = time.perf_counter()
+        completion = config.llamacppMainModel.create_chat_completion(messages=messages, max_tokens=1, stream=True)
+        next(iter(completion))
+        latency = time.perf_counter() - start
+        for _ in completion:
+            pass
+        # the first turn evaluates the whole chat in both layouts
+        if i:
+            latencies.append(latency)
+        messages.append({"role": "assistant", "content": "I am not sure."})
+    return sum(latencies) / len(latencies) * 1000
+
+before = benchmark(False)
+after = benchmark(True)
+
+print(f"Model: {config.llamacppMainModel_model_path}")
+print(f"History turns: {history_turns}; measured turns: {measured_turns}")
+print(f"Moving system message: {before:.1f} ms to first token")
+print(f"Cache-friendly system message: {after:.1f} ms to first token")
+print(f"Speed-up: {before / after:.1f}x")
@@ -0,0 +1,56 @@
+from freegenius import config, getEmbeddingFunction, get_or_create_collection, add_vectors, query_vectors, clearEmbeddingCache
+from chromadb.config import Settings
+import chromadb, time
+
+# compare per-turn tool selection latency, with and without the process-wide embedding function and collection cache
+
+tools = {
+    "search_google": "What is the latest news about AI?\nSearch online for the weather in London.",
+    "get_current_time": "What time is it now?\nTell me the current date and time.",
+    "execute_computing_task": "Create a folder 'demo' in my home directory.\nList all files in the current directory.",
+    "send_email": "Send an email to John about tomorrow's meeting.\nEmail my team a summary of the project.",
+    "create_image": "Draw a picture of a cat sitting on a chair.\nGenerate an image of a sunset.",
+}
+queries = [
+    "What's the weather like in Hong Kong today?",
+    "Please delete all temporary files in my download folder.",
+    "Write an email to Mary to thank her for the gift.",
+    "Paint a landscape with mountains and a lake.",
+    "What time is it in New York?",
+]
+turns = 20
+
+client = chromadb.EphemeralClient(Settings(anonymized_telemetry=False))
+collection = get_or_create_collection(client, "tools")
+add_vectors(collection, list(tools.values()), [{"name": i, "parameters": "{}"} for i in tools], list(tools.keys()))
+
+def uncached_selection(query):
+    # what each genius call did before: a new embedding function and collection handle on every turn
+    collection = client.get_or_create_collection(
+        name="tools",
+        metadata={"hnsw:space": "cosine"},
+        embedding_function=getEmbeddingFunction(),
+    )
+    clearEmbeddingCache()
+    return query_vectors(collection, query, config.tool_selection_max_choices)
+
+def cached_selection(query):
+    collection = get_or_create_collection(client, "tools")
+    return query_vectors(collection, query, config.tool_selection_max_choices)
+
+def benchmark(selection):
+    start = time.perf_counter()
+    for i in range(turns):
+        selection(queries[i % len(queries)])
+    return (time.perf_counter() - start) / turns * 1000
+
+before = benchmark(uncached_selection)
+# warm up the cache before measuring
+cached_selection(queries[0])
+after = benchmark(cached_selection)
+
+print(f"Embedding model: {config.embeddingModel}")
+print(f"Turns: {turns}")
+print(f"Before: {before:.1f} ms per turn")
+print(f"After: {after:.1f} ms per turn")
+print(f"Speed-up: {before / after:.1f}x")